@@ -50,7 +50,7 @@ def check_session():
 
     # 2. Jika belum, coba ambil token dari cookie
     token = get_session_token()
-    logger.debug(f"token = {token}")
+    logger.debug("token = %s", token)
 
     if not token:
         logger.debug("No session token found in cookie.")
@@ -4,6 +4,7 @@ Configuration and initialization for the finance chatbot.
 
 import os
 import logging
+from logging.handlers import RotatingFileHandler
 from dotenv import load_dotenv
 
 load_dotenv() 
@@ -25,7 +26,8 @@ TEMPLATE_SPREADSHEET_URL = "https://docs.google.com/spreadsheets/d/1WJ75Y1uN2J1-
 LOG_FILENAME = "finance_chatbot.log"
 logger = logging.getLogger("finance_chatbot")
 logger.setLevel(logging.DEBUG)
-fh = logging.FileHandler(LOG_FILENAME)
+# Rotated so DEBUG logging cannot grow the file without bound
+fh = RotatingFileHandler(LOG_FILENAME, maxBytes=2_000_000, backupCount=3)
 fh.setLevel(logging.DEBUG)
 formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
 fh.setFormatter(formatter)
@@ -3,7 +3,8 @@ Data analysis tools for the finance chatbot.
 """
 
 import logging
-from datetime import datetime, timedelta
+from datetime import timedelta
+from typing import Callable, Dict, Optional, Tuple
 import pandas as pd
 
 logger = logging.getLogger("finance_chatbot")
@@ -15,46 +16,123 @@ class DataAnalyzer:
     
     def __init__(self, sheets_client):
         self.sheets_client = sheets_client
+        # Report text per (method, args), tagged with the data version and month it was built for
+        self._reports: Dict[tuple, Tuple[int, str, str]] = {}
+        # Case-folded notes for keyword search, tagged with the data version they were built from
+        self._notes: Optional[Tuple[int, pd.Series]] = None
+    
+    def _memoized(self, key: tuple, build: Callable[[], str]) -> str:
+        """
+        Return the report built for key while the sheet data and the current month are unchanged.
+        The version is read before building, so a refresh during the build only costs one rebuild.
+        """
+        version = self.sheets_client.data_version
+        month = pd.Timestamp.now().strftime('%Y-%m')
+        cached = self._reports.get(key)
+        if cached and cached[:2] == (version, month) and self.sheets_client.is_cache_fresh():
+            return cached[2]
+        text = build()
+        if not text.startswith("Error"):
+            self._reports[key] = (version, month, text)
+        return text
+    
+    def _df(self) -> pd.DataFrame:
+        """
+        Typed transactions (date as datetime64, amount as float64) from the client's cached read,
+        with the month start and expense/income flags every analysis filters on.
+        """
+        df = self.sheets_client.get_transactions_df()
+        if df.empty:
+            return df
+        df['month'] = df['date'].to_numpy().astype('datetime64[M]').astype('datetime64[ns]')
+        df['is_expense'] = df['type'] == 'expense'
+        df['is_income'] = df['type'] == 'income'
+        return df
+    
+    def _folded_notes(self, df: pd.DataFrame, version: Optional[int]) -> pd.Series:
+        """
+        Lowercased note column, rebuilt from df only when the sheet data changes.
+        version must be read before df was loaded, so a refresh in between only costs one rebuild.
+        """
+        if self._notes is None or self._notes[0] != version:
+            self._notes = (version, df['note'].fillna('').astype(str).str.lower())
+        return self._notes[1]
+    
+    @staticmethod
+    def _txn_lines(df: pd.DataFrame, with_type: bool = True) -> str:
+        """'- dd/mm/yyyy: note (category) - Rp amount' per row, built column-wise and joined once."""
+        # Unparseable sheet dates are NaT, which strftime turns into NaN
+        lines = (
+            "- " + df['date'].dt.strftime('%d/%m/%Y').fillna("-")
+            + ": " + df['note'].astype(str)
+            + " (" + df['category'].astype(str) + ") - Rp "
+            + df['amount'].map("{:,.2f}".format)
+        )
+        if with_type:
+            lines = lines + " (" + df['type'].astype(str) + ")"
+        return "".join(lines + "\n")
+    
+    @staticmethod
+    def _amount_lines(amounts: pd.Series, total: float = None) -> str:
+        """'- name: Rp amount' per entry, with its share of total when given."""
+        lines = "- " + amounts.index.to_series().astype(str) + ": Rp " + amounts.map("{:,.2f}".format)
+        if total is not None:
+            lines = lines + " (" + (amounts / total * 100).map("{:.1f}%".format) + ")"
+        return "".join(lines + "\n")
+    
+    @staticmethod
+    def _filter_period(df: pd.DataFrame, period: str) -> pd.DataFrame:
+        # Bounds are Timestamps so they compare directly with the datetime64 date column
+        current_month_start = pd.Timestamp.now().normalize().replace(day=1)
+        if period == "current_month":
+            return df[df['date'] >= current_month_start]
+        if period == "last_month":
+            last_month_start = (current_month_start - timedelta(days=1)).replace(day=1)
+            return df[(df['date'] >= last_month_start) & (df['date'] < current_month_start)]
+        if period == "last_3_months":
+            return df[df['date'] >= current_month_start - timedelta(days=90)]
+        return df
     
     def get_data_summary(self) -> str:
         """
         Generate a comprehensive summary of the financial data for AI analysis.
         """
+        return self._memoized(("summary",), self._build_data_summary)
+    
+    def _build_data_summary(self) -> str:
         try:
-            df = self.sheets_client.get_transactions_df()
+            df = self._df()
             if df.empty:
                 return "Tidak ada data transaksi yang tersedia."
             
-            # Convert date to datetime for analysis
-            df['date'] = pd.to_datetime(df['date'])
-            
-            # Basic statistics
-            total_income = df[df['type'] == 'income']['amount'].sum()
-            total_expense = df[df['type'] == 'expense']['amount'].sum()
+            # Basic statistics: both totals from one pass over the type codes
+            by_type = df.groupby('type', observed=True)['amount'].sum()
+            total_income = by_type.get('income', 0.0)
+            total_expense = by_type.get('expense', 0.0)
             balance = total_income - total_expense
             
-            # Monthly trends
-            current_month = datetime.now().replace(day=1)
+            # Monthly trends: one groupby over (month, type) covers both months
+            current_month = pd.Timestamp.now().normalize().replace(day=1)
             last_month = (current_month - timedelta(days=1)).replace(day=1)
+            by_month = df.groupby(['month', 'type'], observed=True)['amount'].sum()
             
-            current_month_data = df[df['date'] >= current_month]
-            last_month_data = df[(df['date'] >= last_month) & (df['date'] < current_month)]
-            
-            current_month_income = current_month_data[current_month_data['type'] == 'income']['amount'].sum()
-            current_month_expense = current_month_data[current_month_data['type'] == 'expense']['amount'].sum()
+            current_month_income = by_month.get((current_month, 'income'), 0.0)
+            current_month_expense = by_month.get((current_month, 'expense'), 0.0)
             
-            last_month_income = last_month_data[last_month_data['type'] == 'income']['amount'].sum()
-            last_month_expense = last_month_data[last_month_data['type'] == 'expense']['amount'].sum()
+            last_month_income = by_month.get((last_month, 'income'), 0.0)
+            last_month_expense = by_month.get((last_month, 'expense'), 0.0)
             
-            # Category breakdown
-            expense_by_category = df[df['type'] == 'expense'].groupby('category')['amount'].sum().sort_values(ascending=False)
-            income_by_category = df[df['type'] == 'income'].groupby('category')['amount'].sum().sort_values(ascending=False)
+            # Category breakdown: income and expense tables from one groupby
+            by_category = df.groupby(['category', 'type'], observed=True)['amount'].sum().unstack('type')
+            expense_by_category = by_category.get('expense', pd.Series(dtype=float)).dropna().sort_values(ascending=False)
+            income_by_category = by_category.get('income', pd.Series(dtype=float)).dropna().sort_values(ascending=False)
             
             # Top expenses
-            top_expenses = df[df['type'] == 'expense'].sort_values('amount', ascending=False).head(10)
+            # Rank the masked amount column, then take only those rows (no filtered frame copy)
+            top_expenses = df.loc[df['amount'].where(df['is_expense']).nlargest(10).index]
             
             # Recent transactions
-            recent_transactions = df.sort_values('date', ascending=False).head(10)
+            recent_transactions = df.nlargest(10, 'date')
             
             # Build summary text
             summary = f"""
@@ -77,22 +155,17 @@ Bulan Lalu ({last_month.strftime('%B %Y')}):
 
 PENGELUARAN PER KATEGORI:
 """
-            for category, amount in expense_by_category.items():
-                summary += f"- {category}: Rp {amount:,.2f} ({amount/total_expense*100:.1f}%)\n"
-            
-            summary += "\nPEMASUKAN PER KATEGORI:\n"
-            for category, amount in income_by_category.items():
-                summary += f"- {category}: Rp {amount:,.2f} ({amount/total_income*100:.1f}%)\n"
-            
-            summary += "\n10 TRANSAKSI TERBESAR:\n"
-            for _, row in top_expenses.iterrows():
-                summary += f"- {row['date'].strftime('%d/%m/%Y')}: {row['note']} ({row['category']}) - Rp {row['amount']:,.2f}\n"
-            
-            summary += "\n10 TRANSAKSI TERAKHIR:\n"
-            for _, row in recent_transactions.iterrows():
-                summary += f"- {row['date'].strftime('%d/%m/%Y')}: {row['note']} ({row['category']}) - Rp {row['amount']:,.2f} ({row['type']})\n"
-            
-            return summary
+            sections = [
+                summary,
+                self._amount_lines(expense_by_category, total_expense),
+                "\nPEMASUKAN PER KATEGORI:\n",
+                self._amount_lines(income_by_category, total_income),
+                "\n10 TRANSAKSI TERBESAR:\n",
+                self._txn_lines(top_expenses, with_type=False),
+                "\n10 TRANSAKSI TERAKHIR:\n",
+                self._txn_lines(recent_transactions),
+            ]
+            return "".join(sections)
         except Exception as e:
             logger.exception("Failed to generate data summary")
             return f"Error generating data summary: {str(e)}"
@@ -102,29 +175,19 @@ PENGELUARAN PER KATEGORI:
         Get expenses by category, optionally filtered by category and period.
         Period can be "all", "current_month", "last_month", or "last_3_months"
         """
+        return self._memoized(("expenses", category, period), lambda: self._build_expenses_by_category(category, period))
+    
+    def _build_expenses_by_category(self, category: str, period: str) -> str:
         try:
-            df = self.sheets_client.get_transactions_df()
+            df = self._df()
             if df.empty:
                 return "Tidak ada data transaksi yang tersedia."
             
-            # Convert date to datetime for analysis
-            df['date'] = pd.to_datetime(df['date'])
-            
             # Filter by period
-            today = datetime.now().date()
-            if period == "current_month":
-                start_date = today.replace(day=1)
-                df = df[df['date'] >= start_date]
-            elif period == "last_month":
-                current_month_start = today.replace(day=1)
-                last_month_start = (current_month_start - timedelta(days=1)).replace(day=1)
-                df = df[(df['date'] >= last_month_start) & (df['date'] < current_month_start)]
-            elif period == "last_3_months":
-                start_date = (today.replace(day=1) - timedelta(days=90))
-                df = df[df['date'] >= start_date]
+            df = self._filter_period(df, period)
             
             # Filter by type (expense only)
-            df = df[df['type'] == 'expense']
+            df = df[df['is_expense']]
             
             # Filter by category if specified
             if category and category != "all":
@@ -134,7 +197,7 @@ PENGELUARAN PER KATEGORI:
                 return f"Tidak ada data pengeluaran yang ditemukan untuk kategori '{category}' dalam periode {period}."
             
             # Group by category and sum
-            category_expenses = df.groupby('category')['amount'].sum().sort_values(ascending=False)
+            category_expenses = df.groupby('category', observed=True)['amount'].sum().sort_values(ascending=False)
             
             # Build result text
             result = f"PENGELUARAN"
@@ -142,8 +205,7 @@ PENGELUARAN PER KATEGORI:
                 result += f" UNTUK KATEGORI '{category}'"
             result += f" ({period}):\n\n"
             
-            for cat, amount in category_expenses.items():
-                result += f"- {cat}: Rp {amount:,.2f}\n"
+            result += self._amount_lines(category_expenses)
             
             result += f"\nTotal: Rp {category_expenses.sum():,.2f}"
             
@@ -157,29 +219,19 @@ PENGELUARAN PER KATEGORI:
         Get income by category, optionally filtered by category and period.
         Period can be "all", "current_month", "last_month", or "last_3_months"
         """
+        return self._memoized(("income", category, period), lambda: self._build_income_by_category(category, period))
+    
+    def _build_income_by_category(self, category: str, period: str) -> str:
         try:
-            df = self.sheets_client.get_transactions_df()
+            df = self._df()
             if df.empty:
                 return "Tidak ada data transaksi yang tersedia."
             
-            # Convert date to datetime for analysis
-            df['date'] = pd.to_datetime(df['date'])
-            
             # Filter by period
-            today = datetime.now().date()
-            if period == "current_month":
-                start_date = today.replace(day=1)
-                df = df[df['date'] >= start_date]
-            elif period == "last_month":
-                current_month_start = today.replace(day=1)
-                last_month_start = (current_month_start - timedelta(days=1)).replace(day=1)
-                df = df[(df['date'] >= last_month_start) & (df['date'] < current_month_start)]
-            elif period == "last_3_months":
-                start_date = (today.replace(day=1) - timedelta(days=90))
-                df = df[df['date'] >= start_date]
+            df = self._filter_period(df, period)
             
             # Filter by type (income only)
-            df = df[df['type'] == 'income']
+            df = df[df['is_income']]
             
             # Filter by category if specified
             if category and category != "all":
@@ -189,7 +241,7 @@ PENGELUARAN PER KATEGORI:
                 return f"Tidak ada data pemasukan yang ditemukan untuk kategori '{category}' dalam periode {period}."
             
             # Group by category and sum
-            category_income = df.groupby('category')['amount'].sum().sort_values(ascending=False)
+            category_income = df.groupby('category', observed=True)['amount'].sum().sort_values(ascending=False)
             
             # Build result text
             result = f"PEMASUKAN"
@@ -197,8 +249,7 @@ PENGELUARAN PER KATEGORI:
                 result += f" UNTUK KATEGORI '{category}'"
             result += f" ({period}):\n\n"
             
-            for cat, amount in category_income.items():
-                result += f"- {cat}: Rp {amount:,.2f}\n"
+            result += self._amount_lines(category_income)
             
             result += f"\nTotal: Rp {category_income.sum():,.2f}"
             
@@ -212,24 +263,26 @@ PENGELUARAN PER KATEGORI:
         Get transactions containing a specific keyword in the note.
         """
         try:
-            df = self.sheets_client.get_transactions_df()
+            version = self.sheets_client.data_version
+            df = self._df()
             if df.empty:
                 return "Tidak ada data transaksi yang tersedia."
             
-            # Filter by keyword in note
-            filtered_df = df[df['note'].str.contains(keyword, case=False, na=False)]
+            # Plain substring match on the pre-lowercased notes; no regex, no per-call case folding.
+            # The mask is aligned on the index, so rows missing from the cached notes never match
+            notes = self._folded_notes(df, version).reindex(df.index)
+            filtered_df = df[notes.str.contains(keyword.lower(), regex=False).fillna(False).astype(bool)]
             
             if filtered_df.empty:
                 return f"Tidak ada transaksi yang ditemukan dengan kata kunci '{keyword}'."
             
             # Sort by date (most recent first) and limit
-            filtered_df = filtered_df.sort_values('date', ascending=False).head(limit)
+            filtered_df = filtered_df.nlargest(limit, 'date')
             
             # Build result text
             result = f"TRANSAKSI DENGAN KATA KUNCI '{keyword}':\n\n"
             
-            for _, row in filtered_df.iterrows():
-                result += f"- {row['date'].strftime('%d/%m/%Y')}: {row['note']} ({row['category']}) - Rp {row['amount']:,.2f} ({row['type']})\n"
+            result += self._txn_lines(filtered_df)
             
             return result
         except Exception as e:
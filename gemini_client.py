@@ -2,11 +2,13 @@
 Gemini client for the finance chatbot.
 """
 
+import hashlib
 import json
 import logging
-import re
+import threading
+from collections import OrderedDict
 from datetime import date
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, Iterator, Optional
 
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.schema import HumanMessage
@@ -15,6 +17,99 @@ from utils import parse_amount, normalize_category
 
 logger = logging.getLogger("finance_chatbot")
 
+# Per-call generation config for prompts whose reply is parsed as JSON
+JSON_OUTPUT = {"response_mime_type": "application/json"}
+# Data-query answers kept per (question, data summary); the summary changes whenever the data does
+ANSWER_CACHE_SIZE = 256
+
+# Fixed instructions for each prompt. The per-message parts (date, context, data, user text)
+# are appended after them, so every request to a prompt shape starts with the same prefix and
+# Gemini's implicit prefix caching can reuse it.
+_CLASSIFY_INSTRUCTIONS = """
+        Analyze the text in Indonesian given at the end and determine what type of request it is:
+        
+        1. "transaction": it is about a financial transaction (adding a new expense/income)
+        2. "data_query": it is a query about existing financial data (e.g., "what's my biggest expense?", "how much did I spend on food?")
+        3. "conversation": it is just a general conversation
+        
+        Use chain of thought to analyze:
+        1. Does the text mention adding, recording, or inputting money, spending, or income?
+        2. Does it contain specific amounts or prices for a new transaction?
+        3. Is it describing a purchase, payment, or earning that happened?
+        4. Or is it asking questions about existing data?
+        
+        If it is a transaction, also extract it:
+        1. Identify the date of the transaction (if not mentioned, use today's date given below)
+        2. Identify the amount - if there are quantities and unit prices, calculate the total
+        3. Determine if it's an expense or income
+        4. Categorize the transaction appropriately
+        5. Extract a brief description/note
+        
+        Return a JSON object with these keys:
+        - intent: "transaction", "data_query", or "conversation"
+        - reasoning: brief explanation of your decision
+        - response: a friendly response to the user (if it's just a conversation)
+        - transaction: only if intent is "transaction", an object with these keys:
+            - date: transaction date in YYYY-MM-DD format
+            - amount: numeric value without currency symbols
+            - type: either "expense" or "income"
+            - category: one of these categories: food, transport, shopping, bills, entertainment, health, education, income, or uncategorized
+            - note: brief description of the transaction
+            - reasoning: brief explanation of how you calculated the amount
+        
+        Only return valid JSON, nothing else.
+"""
+
+_CONTEXT_INSTRUCTIONS = """
+        Analisis teks pengguna baru (di bagian akhir) dalam konteks transaksi sebelumnya.
+        
+        Tugas Anda adalah memutuskan apakah teks baru ini:
+        1. **Merupakan pembaruan** dari transaksi sebelumnya (misalnya, menambah biaya ongkir, mengubah jumlah, dll.).
+        2. **Merupakan transaksi baru** yang sama sekali berbeda.
+        3. Hanya percakapan biasa.
+        
+        Jika ini adalah pembaruan, hitung total baru dan gabungkan informasinya.
+        Jika ini adalah transaksi baru, ekstrak informasinya seperti biasa.
+        
+        Return a JSON object with these keys:
+        - intent: "update_transaction", "new_transaction", or "conversation"
+        - date: transaction date in YYYY-MM-DD format
+        - amount: numeric value without currency symbols (total if updated)
+        - type: either "expense" or "income"
+        - category: one of these categories: food, transport, shopping, bills, entertainment, health, education, income, or uncategorized
+        - note: brief description of the transaction (combine if updated)
+        - reasoning: brief explanation of your decision
+        
+        Only return valid JSON, nothing else.
+"""
+
+_FRIENDLY_INSTRUCTIONS = """
+        Generate a friendly, conversational response to the text in Indonesian given at the end.
+        The user is talking to a finance chatbot, but this message is not about a transaction or data query.
+        
+        Your response should:
+        1. Be friendly and conversational
+        2. Acknowledge what the user said
+        3. Gently remind them that you're here to help with financial transactions and data analysis
+        4. Keep it brief and natural
+        5. Use Jaksel Indonesia style language such as gw, lo, mantap, etc.
+        
+        Only return the response text, nothing else.
+"""
+
+_DATA_QUERY_INSTRUCTIONS = """
+        Analyze the user query about financial data given at the end and provide a helpful response based on the data summary.
+        
+        Your response should:
+        1. Directly answer the user's question based on the data
+        2. Provide specific numbers and details when possible
+        3. Be conversational and friendly
+        4. Use Jaksel Indonesia style language such as gw, lo, mantap, etc.
+        5. If the data doesn't contain enough information to answer the question, explain what data would be needed
+        
+        Only return the response text, nothing else.
+"""
+
 class GeminiClient:
     """
     Gemini Flash 2.5 API client for transaction parsing using LangChain.
@@ -29,13 +124,16 @@ class GeminiClient:
             temperature=0.1,
             convert_system_message_to_human=True
         )
+        # The client is shared between sessions, so the answer cache is guarded by a lock
+        self._answers: "OrderedDict[str, str]" = OrderedDict()
+        self._answers_lock = threading.Lock()
         logger.info("Gemini client initialized with LangChain")
 
     def generate(self, prompt: str, max_tokens: int = 512) -> str:
         """
         Generate text from prompt using Gemini Flash 2.5 via LangChain.
         """
-        logger.info(f"GeminiClient.generate called")
+        logger.info("GeminiClient.generate called")
         try:
             messages = [HumanMessage(content=prompt)]
             response = self.model.invoke(messages)
@@ -44,58 +142,33 @@ class GeminiClient:
             logger.exception("Gemini API error")
             raise Exception(f"Gemini API error: {e}")
 
-    def is_transaction(self, text: str) -> Tuple[bool, bool, str, str]:
+    def generate_json(self, prompt: str) -> Dict[str, Any]:
         """
-        Determine if the text is about a financial transaction, a data query, or just a conversation.
-        Returns a tuple of (is_transaction, is_data_query, reasoning, response)
+        Generate a JSON object from prompt. Gemini's JSON output mode returns bare JSON,
+        so the reply goes straight to json.loads without stripping markdown fences.
         """
-        prompt = f"""
-        Analyze the following text in Indonesian and determine what type of request it is:
-        
-        1. Is it about a financial transaction (adding a new expense/income)?
-        2. Is it a query about existing financial data?
-        3. Is it just a general conversation?
-        
-        Use chain of thought to analyze:
-        1. Does the text mention adding, recording, or inputting money, spending, or income?
-        2. Does it contain specific amounts or prices for a new transaction?
-        3. Is it describing a purchase, payment, or earning that happened?
-        4. Or is it asking questions about existing data (e.g., "what's my biggest expense?", "how much did I spend on food?")?
-        
-        Text: "{text}"
-        
-        Return a JSON object with these keys:
-        - is_transaction: true if it's about adding a new financial transaction, false otherwise
-        - is_data_query: true if it's asking about existing financial data, false otherwise
-        - reasoning: brief explanation of your decision
-        - response: a friendly response to the user (if it's just a conversation)
-        
-        Only return valid JSON, nothing else.
+        logger.info("GeminiClient.generate_json called")
+        try:
+            messages = [HumanMessage(content=prompt)]
+            response = self.model.invoke(messages, generation_config=JSON_OUTPUT)
+        except Exception as e:
+            logger.exception("Gemini API error")
+            raise Exception(f"Gemini API error: {e}")
+        logger.debug("Gemini JSON response: %s", response.content)
+        return json.loads(response.content)
+
+    def stream(self, prompt: str) -> Iterator[str]:
         """
-        
+        Stream text from prompt as Gemini produces it, so the UI can show the first words early.
+        """
+        logger.info("GeminiClient.stream called")
         try:
-            response = self.generate(prompt)
-            logger.debug(f"Gemini is_transaction raw response: {response}")
-            
-            # Clean up response to ensure it's valid JSON
-            json_match = re.search(r'```json\n(.*?)\n```', response, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-            else:
-                # Try to extract JSON directly
-                json_str = response.strip()
-            
-            parsed = json.loads(json_str)
-            return (
-                parsed.get("is_transaction", False), 
-                parsed.get("is_data_query", False), 
-                parsed.get("reasoning", ""), 
-                parsed.get("response", "")
-            )
+            for chunk in self.model.stream([HumanMessage(content=prompt)]):
+                if chunk.content:
+                    yield chunk.content
         except Exception as e:
-            logger.exception("Failed to determine text type")
-            # Default to treating as transaction if analysis fails
-            return True, False, "Analysis failed, defaulting to transaction", ""
+            logger.exception("Gemini API error")
+            raise Exception(f"Gemini API error: {e}")
 
     def parse_transaction(self, text: str) -> Dict[str, Any]:
         """
@@ -126,18 +199,7 @@ class GeminiClient:
         """
         
         try:
-            response = self.generate(prompt)
-            logger.debug(f"Gemini raw response: {response}")
-            
-            # Clean up response to ensure it's valid JSON
-            json_match = re.search(r'```json\n(.*?)\n```', response, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-            else:
-                # Try to extract JSON directly
-                json_str = response.strip()
-            
-            parsed = json.loads(json_str)
+            parsed = self.generate_json(prompt)
             
             # Normalize values
             if "amount" in parsed:
@@ -150,12 +212,49 @@ class GeminiClient:
             logger.exception("Failed to parse transaction with Gemini")
             raise Exception(f"Failed to parse transaction: {e}")
 
+    @staticmethod
+    def _history_block(history: str) -> str:
+        """Earlier conversation (summary and recent turns) for a prompt; empty when there is none."""
+        if not history:
+            return ""
+        return f"""
+        Earlier conversation, for context only:
+        {history}
+        """
+
+    def classify_and_parse(self, text: str, history: str = "") -> Dict[str, Any]:
+        """
+        Classify the text and, if it is a new transaction, parse it in the same Gemini call.
+        history is the earlier conversation, so follow-ups like "yang tadi" can be resolved.
+        Returns a dict with intent ("transaction", "data_query" or "conversation"), reasoning,
+        response and, for transactions, a normalized "transaction" dict.
+        """
+        prompt = f"""{_CLASSIFY_INSTRUCTIONS}
+        Today's date: {date.today().isoformat()}
+        {self._history_block(history)}
+        Text: "{text}"
+        """
+        
+        try:
+            parsed = self.generate_json(prompt)
+            
+            # Normalize values only if it's a transaction
+            txn = parsed.get("transaction")
+            if parsed.get("intent") == "transaction" and txn:
+                if "amount" in txn:
+                    txn["amount"] = parse_amount(str(txn["amount"]))
+                if "category" in txn:
+                    txn["category"] = normalize_category(txn.get("category"))
+            
+            return parsed
+        except Exception as e:
+            logger.exception("Failed to classify and parse text")
+            raise Exception(f"Failed to analyze message: {e}")
+
     def parse_transaction_with_context(self, text: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """
         Parse transaction with context from a previous pending transaction.
         """
-        today_str = date.today().isoformat()
-        
         # Format context menjadi string yang mudah dibaca
         context_str = f"""
         Transaksi Sebelumnya yang Sedang Diproses:
@@ -166,45 +265,14 @@ class GeminiClient:
         - Catatan: {context.get('note', 'N/A')}
         """
         
-        prompt = f"""
-        Analisis teks pengguna berikut dalam konteks transaksi sebelumnya.
-        
+        prompt = f"""{_CONTEXT_INSTRUCTIONS}
         {context_str}
         
         Teks Pengguna Baru: "{text}"
-        
-        Tugas Anda adalah memutuskan apakah teks baru ini:
-        1. **Merupakan pembaruan** dari transaksi sebelumnya (misalnya, menambah biaya ongkir, mengubah jumlah, dll.).
-        2. **Merupakan transaksi baru** yang sama sekali berbeda.
-        3. Hanya percakapan biasa.
-        
-        Jika ini adalah pembaruan, hitung total baru dan gabungkan informasinya.
-        Jika ini adalah transaksi baru, ekstrak informasinya seperti biasa.
-        
-        Return a JSON object with these keys:
-        - intent: "update_transaction", "new_transaction", or "conversation"
-        - date: transaction date in YYYY-MM-DD format
-        - amount: numeric value without currency symbols (total if updated)
-        - type: either "expense" or "income"
-        - category: one of these categories: food, transport, shopping, bills, entertainment, health, education, income, or uncategorized
-        - note: brief description of the transaction (combine if updated)
-        - reasoning: brief explanation of your decision
-        
-        Only return valid JSON, nothing else.
         """
         
         try:
-            response = self.generate(prompt, max_tokens=1024)
-            logger.debug(f"Gemini with context raw response: {response}")
-            
-            # Clean up response to ensure it's valid JSON
-            json_match = re.search(r'```json\n(.*?)\n```', response, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-            else:
-                json_str = response.strip()
-            
-            parsed = json.loads(json_str)
+            parsed = self.generate_json(prompt)
             
             # Normalize values only if it's a transaction
             if parsed.get("intent") in ["update_transaction", "new_transaction"]:
@@ -220,60 +288,104 @@ class GeminiClient:
             logger.info("Falling back to parsing without context.")
             return self.parse_transaction(text)
         
-    def generate_friendly_response(self, text: str) -> str:
+    def _friendly_prompt(self, text: str, history: str = "") -> str:
+        return f"""{_FRIENDLY_INSTRUCTIONS}
+        {self._history_block(history)}
+        Text: "{text}"
         """
-        Generate a friendly conversational response for non-transaction text.
+
+    def generate_friendly_response(self, text: str, history: str = "") -> str:
         """
-        prompt = f"""
-        Generate a friendly, conversational response to the following text in Indonesian.
-        The user is talking to a finance chatbot, but this message is not about a transaction or data query.
-        
-        Text: "{text}"
-        
-        Your response should:
-        1. Be friendly and conversational
-        2. Acknowledge what the user said
-        3. Gently remind them that you're here to help with financial transactions and data analysis
-        4. Keep it brief and natural
-        5. Use Jaksel Indonesia style language such as gw, lo, mantap, etc.
-        
-        Only return the response text, nothing else.
+        Generate a friendly conversational response for non-transaction text.
         """
-        
         try:
-            response = self.generate(prompt)
-            logger.debug(f"Gemini friendly response: {response}")
+            response = self.generate(self._friendly_prompt(text, history))
+            logger.debug("Gemini friendly response: %s", response)
             return response.strip()
         except Exception as e:
             logger.exception("Failed to generate friendly response")
             return "Maaf, saya tidak dapat memproses pesan Anda. Saya di sini untuk membantu mencatat transaksi keuangan Anda dan menganalisis data Anda."
 
-    def analyze_data_query(self, text: str, data_summary: str) -> str:
+    def stream_friendly_response(self, text: str, history: str = "") -> Iterator[str]:
         """
-        Analyze a data query using the provided data summary.
+        Same as generate_friendly_response, yielded chunk by chunk as Gemini produces it.
         """
-        prompt = f"""
-        Analyze the following user query about financial data and provide a helpful response based on the data summary.
-        
-        User query: "{text}"
-        
+        try:
+            yield from self.stream(self._friendly_prompt(text, history))
+        except Exception:
+            logger.exception("Failed to generate friendly response")
+            yield "Maaf, saya tidak dapat memproses pesan Anda. Saya di sini untuk membantu mencatat transaksi keuangan Anda dan menganalisis data Anda."
+
+    def _data_query_prompt(self, text: str, data_summary: str) -> str:
+        return f"""{_DATA_QUERY_INSTRUCTIONS}
         Data summary:
         {data_summary}
         
-        Your response should:
-        1. Directly answer the user's question based on the data
-        2. Provide specific numbers and details when possible
-        3. Be conversational and friendly
-        4. Use Jaksel Indonesia style language such as gw, lo, mantap, etc.
-        5. If the data doesn't contain enough information to answer the question, explain what data would be needed
-        
-        Only return the response text, nothing else.
+        User query: "{text}"
         """
-        
+
+    @staticmethod
+    def _answer_key(text: str, data_summary: str) -> str:
+        question = " ".join(text.lower().split()).rstrip("?!. ")
+        summary_hash = hashlib.sha256(data_summary.encode()).hexdigest()
+        return hashlib.sha256(f"{question}\0{summary_hash}".encode()).hexdigest()
+
+    def _cached_answer(self, key: str) -> Optional[str]:
+        with self._answers_lock:
+            answer = self._answers.get(key)
+            if answer is not None:
+                self._answers.move_to_end(key)
+            return answer
+
+    def _store_answer(self, key: str, answer: str) -> None:
+        with self._answers_lock:
+            self._answers[key] = answer
+            self._answers.move_to_end(key)
+            while len(self._answers) > ANSWER_CACHE_SIZE:
+                self._answers.popitem(last=False)
+
+    def analyze_data_query(self, text: str, data_summary: str) -> str:
+        """
+        Analyze a data query using the provided data summary.
+        Repeating a question over unchanged data returns the earlier answer without calling Gemini.
+        """
+        key = self._answer_key(text, data_summary)
+        cached = self._cached_answer(key)
+        if cached is not None:
+            logger.debug("Data query answered from cache")
+            return cached
         try:
-            response = self.generate(prompt, max_tokens=1024)
-            logger.debug(f"Gemini data analysis response: {response}")
-            return response.strip()
+            response = self.generate(self._data_query_prompt(text, data_summary), max_tokens=1024)
+            logger.debug("Gemini data analysis response: %s", response)
+            answer = response.strip()
+            # An empty reply is not cached, or the same question would keep getting an empty bubble
+            if answer:
+                self._store_answer(key, answer)
+            return answer
         except Exception as e:
             logger.exception("Failed to analyze data query")
-            return "Maaf, saya tidak dapat menganalisis data Anda saat ini. Silakan coba lagi nanti."
\ No newline at end of file
+            return "Maaf, saya tidak dapat menganalisis data Anda saat ini. Silakan coba lagi nanti."
+
+    def stream_data_query(self, text: str, data_summary: str) -> Iterator[str]:
+        """
+        Same as analyze_data_query, yielded chunk by chunk as Gemini produces it.
+        A cached answer is yielded in one piece.
+        """
+        key = self._answer_key(text, data_summary)
+        cached = self._cached_answer(key)
+        if cached is not None:
+            logger.debug("Data query answered from cache")
+            yield cached
+            return
+        chunks = []
+        try:
+            for chunk in self.stream(self._data_query_prompt(text, data_summary)):
+                chunks.append(chunk)
+                yield chunk
+        except Exception:
+            logger.exception("Failed to analyze data query")
+            yield "Maaf, saya tidak dapat menganalisis data Anda saat ini. Silakan coba lagi nanti."
+            return
+        answer = "".join(chunks).strip()
+        if answer:
+            self._store_answer(key, answer)
@@ -2,23 +2,49 @@
 Google Sheets client for the finance chatbot.
 """
 
+import itertools
 import logging
+import re
+import threading
+import time
 from datetime import datetime
 import pandas as pd
 import gspread
-from typing import Dict, Optional, List, Any, Tuple
+from gspread.utils import DateTimeOption, ValueRenderOption
+from typing import Callable, Dict, Optional, List, Any, Tuple, Union
 from google.oauth2.service_account import Credentials
-from utils import parse_credentials_string
+from utils import parse_credentials_string, parse_amount_series
 
 logger = logging.getLogger("finance_chatbot")
 
+HEADER = ["timestamp", "date", "amount", "type", "category", "note"]
+# Labels the app writes; they lead the categorical dtypes so their codes are the same on every read
+TYPES = ("expense", "income")
+CATEGORIES = ("food", "transport", "shopping", "bills", "entertainment", "health", "education", "income", "uncategorized")
+# How long a read of the sheet is reused before fetching it again
+CACHE_TTL = 60
+# Data versions are unique across every client in the process, so (spreadsheet, version) is a safe
+# cache key even when a client is rebuilt after a credential rotation
+_VERSIONS = itertools.count(1)
+# First row number in an A1 range such as "transactions!A15:F17"
+_UPDATED_ROW_RE = re.compile(r"![A-Z]+(\d+)")
+
 class SheetsClient:
-    def __init__(self, credentials_string: str, spreadsheet_id: str, sheet_name: str = "transactions"):
-        self.service_account_json = credentials_string
+    def __init__(self, credentials: Union[str, Dict[str, Any]], spreadsheet_id: str, sheet_name: str = "transactions"):
+        """
+        credentials: service account info, either the raw JSON string or an already-parsed dict
+        """
+        self.credentials = credentials
         self.spreadsheet_id = spreadsheet_id
         self.sheet_name = sheet_name
         self.gc = None
         self.sh = None
+        # The client is shared between sessions, so the cached frame is guarded by a lock
+        self._df_cache: Optional[pd.DataFrame] = None
+        self._df_loaded_at = 0.0
+        # Bumped on every read that is cached and every write, so a read that raced a write is not cached
+        self._cache_token = next(_VERSIONS)
+        self._cache_lock = threading.Lock()
         self._connect()
 
     def _connect(self):
@@ -28,7 +54,10 @@ class SheetsClient:
                 "https://www.googleapis.com/auth/spreadsheets",
                 "https://www.googleapis.com/auth/drive"
             ]
-            credentials_info = parse_credentials_string(self.service_account_json)
+            if isinstance(self.credentials, dict):
+                credentials_info = self.credentials
+            else:
+                credentials_info = parse_credentials_string(self.credentials)
             creds = Credentials.from_service_account_info(credentials_info, scopes=scopes)
             self.gc = gspread.authorize(creds)
             self.sh = self.gc.open_by_key(self.spreadsheet_id)
@@ -38,45 +67,183 @@ class SheetsClient:
             except gspread.WorksheetNotFound:
                 self.sheet = self.sh.add_worksheet(title=self.sheet_name, rows="1000", cols="20")
                 # add header
-                self.sheet.append_row(["timestamp", "date", "amount", "type", "category", "note"])
+                self.sheet.append_row(HEADER)
             logger.info("Connected to Google Sheets")
         except Exception as e:
             logger.exception("Failed to connect to Google Sheets")
             raise
 
+    @staticmethod
+    def _to_row(txn: Dict[str, Any]) -> List[Any]:
+        return [
+            datetime.utcnow().isoformat(),
+            txn.get("date"),
+            float(txn.get("amount")),
+            txn.get("type"),
+            txn.get("category"),
+            txn.get("note")
+        ]
+
     def append_transaction(self, txn: Dict[str, Any]) -> None:
         """
         txn keys: date, amount, type, category, note
         """
+        self.append_transactions([txn])
+
+    def append_transactions(self, txns: List[Dict[str, Any]]) -> None:
+        """
+        Append several transactions with a single API call (one write request against the quota).
+        """
+        if not txns:
+            return
         try:
-            row = [
-                datetime.utcnow().isoformat(),
-                txn.get("date"),
-                float(txn.get("amount")),
-                txn.get("type"),
-                txn.get("category"),
-                txn.get("note")
-            ]
-            logger.debug(f"Appending row to sheet: {row}")
-            self.sheet.append_row(row, value_input_option="USER_ENTERED")
-            logger.info("Transaction appended to Google Sheets")
+            rows = [self._to_row(txn) for txn in txns]
+            logger.debug("Appending %d row(s) to sheet: %s", len(rows), rows)
+            result = self.sheet.append_rows(rows, value_input_option="USER_ENTERED")
+            logger.info(f"{len(rows)} transaction(s) appended to Google Sheets")
+            self._cache_appended_rows(result, rows)
         except Exception as e:
             logger.exception("Failed to append transaction to Google Sheets")
             raise
 
     def get_transactions_df(self) -> pd.DataFrame:
+        """
+        All transactions, re-read from the sheet at most once per CACHE_TTL seconds.
+        Writes through this client keep the cached copy in sync.
+        """
+        return self.get_versioned_transactions_df()[1]
+
+    def get_versioned_transactions_df(self) -> Tuple[Optional[int], pd.DataFrame]:
+        """
+        Same as get_transactions_df, paired with the data_version that frame belongs to.
+        The version is None when a write raced the read and the frame was not cached.
+        """
+        with self._cache_lock:
+            if self._df_cache is not None and time.monotonic() - self._df_loaded_at < CACHE_TTL:
+                return self._cache_token, self._df_cache.copy()
+            token = self._cache_token
         try:
-            records = self.sheet.get_all_records()
-            df = pd.DataFrame(records)
-            if df.empty:
-                return df
-            # ensure types
-            df['amount'] = pd.to_numeric(df['amount'], errors='coerce').fillna(0.0)
-            df['date'] = pd.to_datetime(df['date'], errors='coerce').dt.date
-            return df
+            # One values.get over A:F; amounts come back as numbers, dates as their displayed text
+            values = self.sheet.get(
+                "A:F",
+                value_render_option=ValueRenderOption.unformatted,
+                date_time_render_option=DateTimeOption.formatted_string,
+            )
+            header, rows = (values[0], values[1:]) if values else ([], [])
+            # the API trims trailing blank cells, so short rows are padded with "" like get_all_records did
+            frame = pd.DataFrame(rows, columns=header) if header else pd.DataFrame()
+            df = self._typed(frame.fillna(""), first_row=2)
         except Exception as e:
             logger.exception("Failed to read transactions from Google Sheets")
             raise
+        version = None
+        with self._cache_lock:
+            if token == self._cache_token:
+                self._cache_token = version = next(_VERSIONS)
+                self._df_cache = df
+                self._df_loaded_at = time.monotonic()
+        return version, df.copy()
+
+    @property
+    def data_version(self) -> int:
+        """Changes whenever the cached frame is replaced, by a fresh read or by a write."""
+        return self._cache_token
+
+    def is_cache_fresh(self) -> bool:
+        with self._cache_lock:
+            return self._df_cache is not None and time.monotonic() - self._df_loaded_at < CACHE_TTL
+
+    def invalidate_cache(self) -> None:
+        with self._cache_lock:
+            self._cache_token = next(_VERSIONS)
+            self._df_cache = None
+
+    @staticmethod
+    def _typed(df: pd.DataFrame, first_row: int) -> pd.DataFrame:
+        if df.empty:
+            return df
+        # ensure types
+        amount = pd.to_numeric(df['amount'], errors='coerce')
+        # amounts typed into the sheet as text ("50rb", "1.200.000") follow the chat input rules
+        typed_as_text = amount.isna() & df['amount'].ne("")
+        if typed_as_text.any():
+            amount = amount.mask(typed_as_text, parse_amount_series(df['amount'][typed_as_text]))
+        df['amount'] = amount.fillna(0.0)
+        # low-cardinality labels: store as codes so filters and groupbys skip string hashing
+        df['type'] = SheetsClient._as_category(df['type'], TYPES)
+        df['category'] = SheetsClient._as_category(df['category'], CATEGORIES)
+        # keep datetime64 so callers never have to re-parse the column. The app writes ISO dates,
+        # parsed with a fixed format; only cells typed another way fall back to per-value parsing
+        dates = pd.to_datetime(df['date'], format='%Y-%m-%d', errors='coerce', cache=True)
+        retry = dates.isna() & df['date'].notna() & df['date'].ne("")
+        if retry.any():
+            dates = dates.mask(retry, pd.to_datetime(df['date'][retry], format='mixed', errors='coerce'))
+        df['date'] = dates
+        # index rows by their sheet row number (row 1 is the header)
+        df.index = pd.RangeIndex(first_row, first_row + len(df), name='_sheet_row')
+        return df
+
+    @staticmethod
+    def _as_category(values: pd.Series, known: Tuple[str, ...]) -> pd.Series:
+        """Categorical with the known labels first; anything else typed into the sheet is appended."""
+        extra = sorted(set(values.dropna().unique()).difference(known), key=str)
+        return values.astype(pd.CategoricalDtype([*known, *extra]))
+
+    def _patch_cache(self, patch: Callable[[pd.DataFrame], Optional[pd.DataFrame]]) -> None:
+        """
+        Apply a write that just succeeded to the cached frame instead of re-reading the sheet.
+        patch returns the new frame, or None when the write does not line up with the cache.
+        """
+        with self._cache_lock:
+            self._cache_token = next(_VERSIONS)
+            cached = self._df_cache
+            if cached is None or list(cached.columns) != HEADER:
+                self._df_cache = None
+                return
+            try:
+                df = patch(cached)
+            except Exception:
+                logger.exception("Failed to patch cached transactions, dropping the cache")
+                df = None
+            if df is not None:
+                # concat keeps the dtype when both sides share it; a new label falls back to object
+                for col, known in (('type', TYPES), ('category', CATEGORIES)):
+                    if not isinstance(df[col].dtype, pd.CategoricalDtype):
+                        df[col] = self._as_category(df[col], known)
+            self._df_cache = df
+
+    def _cache_appended_rows(self, result: Any, rows: List[List[Any]]) -> None:
+        """
+        Add just-appended rows to the cached frame.
+        The first row number comes from the API response; if it cannot be read, drop the cache.
+        """
+        try:
+            match = _UPDATED_ROW_RE.search(result["updates"]["updatedRange"])
+            row_number = int(match.group(1))
+        except Exception:
+            self.invalidate_cache()
+            return
+        self._patch_cache(lambda cached: pd.concat([
+            cached, self._typed(pd.DataFrame(rows, columns=HEADER), first_row=row_number)
+        ]))
+
+    def _cache_updated_row(self, row_index: int, row: List[Any]) -> None:
+        def replace(cached: pd.DataFrame) -> Optional[pd.DataFrame]:
+            if row_index not in cached.index:
+                return None
+            new = self._typed(pd.DataFrame([row], columns=HEADER), first_row=row_index)
+            return pd.concat([cached.drop(index=row_index), new]).sort_index()
+        self._patch_cache(replace)
+
+    def _cache_deleted_row(self, row_index: int) -> None:
+        def drop(cached: pd.DataFrame) -> Optional[pd.DataFrame]:
+            if row_index not in cached.index:
+                return None
+            df = cached.drop(index=row_index)
+            # the sheet shifts every row below the deleted one up by one
+            df.index = df.index.where(df.index < row_index, df.index - 1)
+            return df
+        self._patch_cache(drop)
     
     def update_transaction(self, row_index: int, txn: Dict[str, Any]) -> None:
         """
@@ -87,17 +254,11 @@ class SheetsClient:
             if row_index < 2:
                 raise ValueError("Row index must be >= 2 (to skip header)")
             
-            row = [
-                datetime.utcnow().isoformat(),
-                txn.get("date"),
-                float(txn.get("amount")),
-                txn.get("type"),
-                txn.get("category"),
-                txn.get("note")
-            ]
-            logger.debug(f"Updating row {row_index} in sheet: {row}")
+            row = self._to_row(txn)
+            logger.debug("Updating row %d in sheet: %s", row_index, row)
             self.sheet.update(f"A{row_index}:F{row_index}", [row], value_input_option="USER_ENTERED")
             logger.info(f"Transaction at row {row_index} updated in Google Sheets")
+            self._cache_updated_row(row_index, row)
         except Exception as e:
             logger.exception("Failed to update transaction in Google Sheets")
             raise
@@ -111,9 +272,10 @@ class SheetsClient:
             if row_index < 2:
                 raise ValueError("Row index must be >= 2 (to skip header)")
             
-            logger.debug(f"Deleting row {row_index} from sheet")
+            logger.debug("Deleting row %d from sheet", row_index)
             self.sheet.delete_rows(row_index)
             logger.info(f"Transaction at row {row_index} deleted in Google Sheets")
+            self._cache_deleted_row(row_index)
         except Exception as e:
             logger.exception("Failed to delete transaction in Google Sheets")
             raise
\ No newline at end of file
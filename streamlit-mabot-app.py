@@ -1,18 +1,18 @@
 """
 Main Streamlit app for the Mabot: AI Gemini Finance Chatbot.
 """
-import os
+import time
+import hashlib
+import html
+import threading
+from collections import deque
+from concurrent.futures import Future
+from pathlib import Path
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 from datetime import datetime
-from langchain.memory import ConversationBufferMemory
-from auth import show_login_page, logout, check_session
-from utils import extract_spreadsheet_id_from_url
-from sheets_client import SheetsClient
 from cookie_manager import get_cookies
 
 # Import our modules
@@ -20,31 +20,259 @@ from config import (
     GOOGLE_SHEETS_JSON, SHEET_NAME, GEMINI_API_KEY, 
     logger, DATABASE_URL, TEMPLATE_SPREADSHEET_URL
 )
-from utils import parse_amount, normalize_category, format_amount, paginate_dataframe, extract_spreadsheet_id_from_url
-from sheets_client import SheetsClient
-from gemini_client import GeminiClient
+from utils import parse_amount, normalize_category, format_amount, extract_spreadsheet_id_from_url, parse_credentials_string, quick_intent
+from sheets_client import SheetsClient, TYPES, CATEGORIES
 from data_analyzer import DataAnalyzer
 from database import Database
-from auth import show_login_page, logout
+from auth import show_login_page, logout, check_session
+
+EXAMPLE_QUERIES = (
+    "Berapa total pengeluaran saya bulan ini?",
+    "Apa kategori pengeluaran terbesar saya?",
+    "Berapa pengeluaran saya untuk makanan bulan ini?",
+    "Tunjukkan transaksi terkait 'transport'",
+    "Berapa pemasukan vs pengeluaran saya 3 bulan terakhir?",
+    "Apa saja transaksi terbesar saya?",
+)
+
+CSS_PATH = Path(__file__).parent / "assets" / "app.css"
+CHAT_HISTORY_LIMIT = 200
+# Messages are summarized in batches so Gemini is asked once per batch, not once per message
+MEMORY_PRUNE_EVERY = 10
+# Speaker labels for the conversation context passed to the Gemini prompts
+MEMORY_SPEAKERS = {"system": "Ringkasan", "human": "Pengguna", "ai": "Bot"}
+DEBUG_LOG_LIMIT = 500
+# Ledger versions kept by the (spreadsheet, data version)-keyed caches (totals, aggregates, figures)
+LEDGER_CACHE_ENTRIES = 32
+# Fields SheetsClient.append_transaction needs; everything else Gemini returns is display-only
+TXN_FIELDS = ("date", "amount", "type", "category", "note")
+CAT_INDEX = {c: i for i, c in enumerate(CATEGORIES)}
+TYPE_INDEX = {t: i for i, t in enumerate(TYPES)}
+TABLE_COLUMNS = ("date", "category", "type", "amount", "note")
+NOTE_PREVIEW_CHARS = 40
+
+# ---------------------------
+# Cached resources
+# ---------------------------
+@st.cache_resource(show_spinner=False)
+def _style_tag() -> str:
+    """The stylesheet as a ready <style> tag. It must be re-emitted every run or Streamlit drops it,
+    so only the file read and wrapping are cached (cache_resource: no per-run unpickled copy)."""
+    return f"<style>{CSS_PATH.read_text(encoding='utf-8')}</style>"
+
+@st.cache_resource(show_spinner=False)
+def _gemini(api_key: str):
+    """One GeminiClient (and its HTTP connection pool) shared by every session."""
+    # LangChain is imported on first use so the login page renders without loading it
+    from gemini_client import GeminiClient
+    return GeminiClient(api_key=api_key)
+
+@st.cache_data(show_spinner=False)
+def _sheets_credentials(credentials_json: str) -> dict:
+    """Service-account JSON parsed once per distinct content (cache_data hashes the string)."""
+    return parse_credentials_string(credentials_json)
+
+@st.cache_resource(show_spinner=False)
+def _get_sheets(spreadsheet_id: str, sheet_name: str, creds_hash: str) -> SheetsClient:
+    """Shared SheetsClient per spreadsheet; creds_hash invalidates on credential rotation."""
+    return SheetsClient(
+        credentials=_sheets_credentials(GOOGLE_SHEETS_JSON),
+        spreadsheet_id=spreadsheet_id,
+        sheet_name=sheet_name
+    )
+
+@st.cache_resource(show_spinner=False)
+def _get_analyzer(spreadsheet_id: str, sheet_name: str, creds_hash: str) -> DataAnalyzer:
+    return DataAnalyzer(_get_sheets(spreadsheet_id, sheet_name, creds_hash))
+
+# ---------------------------
+# Cached data
+# ---------------------------
+@st.cache_data(ttl=60, show_spinner=False)
+def load_tx_df(_sheets_client: SheetsClient, spreadsheet_id: str) -> tuple:
+    """
+    (data version, transactions) for a spreadsheet, reused across reruns until the TTL expires or a
+    write clears it. The version keys every cache derived from the frame.
+    """
+    version, df = _sheets_client.get_versioned_transactions_df()
+    if version is None:
+        # A write raced this read; give the frame a key no other frame will ever share
+        version = f"uncached-{time.monotonic_ns()}"
+    if df.empty or df['date'].is_monotonic_decreasing:
+        return version, df
+    # Newest first. The index is kept (no ignore_index) because it is the
+    # Google Sheets row number used by edit and delete.
+    return version, df.sort_values('date', ascending=False, kind='stable')
+
+# The caches below are keyed on (spreadsheet_id, version) only; the frame itself (_df) is not hashed
+@st.cache_data(show_spinner=False, max_entries=LEDGER_CACHE_ENTRIES)
+def tx_totals(spreadsheet_id: str, version, _df: pd.DataFrame) -> dict:
+    """Income/expense totals plus the formatted metric strings, so reruns skip re-formatting."""
+    df = _df
+    if df.empty:
+        total_income = total_expense = 0.0
+    else:
+        # Code type as its position in TYPES (-1 for anything else) and sum both totals
+        # in one weighted bincount instead of a groupby
+        codes = pd.Index(TYPES).get_indexer(df['type'])
+        known = codes >= 0
+        sums = np.bincount(codes[known], weights=df['amount'].to_numpy()[known], minlength=len(TYPES))
+        total_expense, total_income = float(sums[TYPE_INDEX['expense']]), float(sums[TYPE_INDEX['income']])
+    return {
+        "income": total_income,
+        "expense": total_expense,
+        "income_fmt": f"Rp {format_amount(total_income)}",
+        "expense_fmt": f"Rp {format_amount(total_expense)}",
+        "balance_fmt": f"Rp {format_amount(total_income - total_expense)}",
+    }
+
+@st.cache_data(show_spinner=False, max_entries=LEDGER_CACHE_ENTRIES)
+def _aggregate(spreadsheet_id: str, version, _df: pd.DataFrame) -> dict:
+    """Every groupby behind the Visualisasi/Analisis tabs, computed once per ledger version."""
+    df = _df
+    # One hash build for both category breakdowns; NaN marks category/type pairs with no rows
+    by_cat_type = df.pivot_table(index='category', columns='type', values='amount', aggfunc='sum', sort=False, observed=True)
+    # Charts only show the largest categories, so take a bounded top-k (NaN is skipped)
+    # instead of sorting the whole breakdown
+    cat_sum = by_cat_type.sum(axis=1).nlargest(15)
+    if 'expense' in by_cat_type.columns:
+        expense_by_cat = by_cat_type['expense'].nlargest(15)
+    else:
+        expense_by_cat = pd.Series(dtype=float)
+    # Floor to the first day of the month in numpy, without building Period objects
+    month = df['date'].to_numpy().astype('datetime64[M]').astype('datetime64[ns]')
+    # Months stay sorted (the default) so the trend line runs left to right
+    monthly = (
+        df.assign(month=month)
+        .pivot_table(index='month', columns='type', values='amount', aggfunc='sum', fill_value=0, observed=True)
+        .reindex(columns=['expense', 'income'], fill_value=0)
+    )
+    return {
+        "cat_sum": cat_sum,
+        "expense_by_cat": expense_by_cat,
+        "top_expense": expense_by_cat.head(10),
+        # Series indexed by date; the chart takes index and values directly, no extra DataFrame
+        "daily_count": df['date'].value_counts(sort=False).sort_index(),
+        "monthly": monthly,
+    }
+
+@st.cache_resource(show_spinner=False)
+def _plotly_json_engine() -> str:
+    """Serialise figures with orjson when it is installed; st.plotly_chart encodes every rerun."""
+    import plotly.io as pio
+    try:
+        import orjson  # noqa: F401
+    except ImportError:
+        logger.info("orjson not installed, Plotly uses the stdlib json encoder")
+        return pio.json.config.default_engine
+    pio.json.config.default_engine = "orjson"
+    return "orjson"
+
+# Figures are cached as resources keyed on the same (spreadsheet, version), so interaction-only
+# reruns (row selection, edit, pagination) skip Plotly construction entirely.
+# Plotly is imported inside the builders so the login/setup pages never load it.
+@st.cache_resource(show_spinner=False, max_entries=LEDGER_CACHE_ENTRIES)
+def build_dashboard_fig(spreadsheet_id: str, version, _df: pd.DataFrame, total_income: float, total_expense: float):
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+    
+    aggs = _aggregate(spreadsheet_id, version, _df)
+    
+    # Create subplots
+    fig = make_subplots(
+        rows=2, cols=2,
+        subplot_titles=("Pengeluaran per Kategori", "Pemasukan vs Pengeluaran", "Transaksi per Hari", "Distribusi Kategori"),
+        specs=[[{"type": "bar"}, {"type": "pie"}],
+               [{"type": "scatter"}, {"type": "bar"}]]
+    )
+    
+    # Expense by category
+    expense_by_cat = aggs["expense_by_cat"]
+    fig.add_trace(
+        go.Bar(x=expense_by_cat.index, y=expense_by_cat.values, name="Pengeluaran"),
+        row=1, col=1
+    )
+    
+    # Income vs Expense
+    fig.add_trace(
+        go.Pie(labels=["Pemasukan", "Pengeluaran"], 
+               values=[total_income, total_expense],
+               hole=0.3),
+        row=1, col=2
+    )
+    
+    # Transactions per day
+    daily_count = aggs["daily_count"]
+    # Plotly serialises datetime64 arrays natively, so no per-row string conversion
+    fig.add_trace(
+        go.Scattergl(x=daily_count.index.to_numpy(), y=daily_count.to_numpy(), mode='lines+markers', name="Transaksi/Hari"),
+        row=2, col=1
+    )
+    
+    # Category distribution
+    cat_sum = aggs["cat_sum"]
+    fig.add_trace(
+        go.Bar(x=cat_sum.index, y=cat_sum.values, name="Total per Kategori"),
+        row=2, col=2
+    )
+    
+    fig.update_layout(height=800, showlegend=False)
+    return fig
+
+@st.cache_resource(show_spinner=False, max_entries=LEDGER_CACHE_ENTRIES)
+def build_monthly_fig(spreadsheet_id: str, version, _df: pd.DataFrame):
+    import plotly.express as px
+    
+    monthly_summary = _aggregate(spreadsheet_id, version, _df)["monthly"]
+    return px.line(
+        monthly_summary.reset_index(), 
+        x='month', 
+        y=['expense', 'income'],
+        labels={'value': 'Jumlah (Rp)', 'month': 'Bulan'},
+        title="Pemasukan vs Pengeluaran per Bulan",
+        render_mode='webgl'
+    )
+
+@st.cache_resource(show_spinner=False, max_entries=LEDGER_CACHE_ENTRIES)
+def build_top_expense_fig(spreadsheet_id: str, version, _df: pd.DataFrame):
+    import plotly.express as px
+    
+    top_expense = _aggregate(spreadsheet_id, version, _df)["top_expense"]
+    return px.bar(
+        x=top_expense.values, 
+        y=top_expense.index,
+        orientation='h',
+        labels={'x': 'Jumlah (Rp)', 'y': 'Kategori'},
+        title="10 Kategori Pengeluaran Teratas"
+    )
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _user_sheets(_db: Database, user_id: int) -> list:
+    """Spreadsheets linked to a user; cleared whenever one is added or removed."""
+    return _db.get_user_spreadsheets(user_id)
+
+def invalidate_tx_cache(spreadsheet_id: str):
+    """Drop cached transactions after a write to Google Sheets."""
+    # Only this spreadsheet's read; other users' sheets stay cached (the client arg is not hashed)
+    # Derived caches need no clearing: the write gave the ledger a new data version
+    load_tx_df.clear(None, spreadsheet_id)
 
 # ---------------------------
 # Streamlit App
 # ---------------------------
 def initialize_state():
     if "chat_history" not in st.session_state:
-        st.session_state.chat_history = []
+        st.session_state.chat_history = deque(maxlen=CHAT_HISTORY_LIMIT)
     if "debug_mode" not in st.session_state:
         st.session_state.debug_mode = False
     if "debug_logs" not in st.session_state:
-        st.session_state.debug_logs = []
+        st.session_state.debug_logs = deque(maxlen=DEBUG_LOG_LIMIT)
     if "edit_mode" not in st.session_state:
         st.session_state.edit_mode = False
     if "edit_row_index" not in st.session_state:
         st.session_state.edit_row_index = None
     if "current_page" not in st.session_state:
         st.session_state.current_page = 1
-    if "memory" not in st.session_state:
-        st.session_state.memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
     if "logged_in" not in st.session_state:
         st.session_state.logged_in = False
     if "db" not in st.session_state:
@@ -55,18 +283,119 @@ def initialize_state():
 
 def add_debug(msg: str):
     if st.session_state.debug_mode:
+        msg = msg if isinstance(msg, str) else str(msg)
+        # Reruns repeat the same status lines (e.g. the Sheets connect); keep one per streak
+        if st.session_state.get("last_debug") == msg:
+            return
+        st.session_state.last_debug = msg
         st.session_state.debug_logs.append(f"{datetime.now().isoformat()} - {msg}")
         logger.debug(msg)
 
+def add_message(role: str, payload, kind: str = "text"):
+    """Append a chat message. Payload stays structured and is only formatted by render_message."""
+    message = {"role": role, "kind": kind, "payload": payload}
+    st.session_state.chat_history.append(message)
+    # The memory gets every message as it is added, so the deque can drop old ones without loss
+    _remember(message)
+
+def _remember(message: dict):
+    """Record a chat message in the summarizing memory that feeds earlier turns back into the prompts."""
+    memory = st.session_state.get("memory")
+    if memory is None:
+        return
+    text = render_message(message)
+    if message["role"] == "user":
+        memory.chat_memory.add_user_message(text)
+    else:
+        memory.chat_memory.add_ai_message(text)
+    # prune() folds everything over max_token_limit into the summary in a single Gemini call
+    recorded = st.session_state.get("remembered_count", 0) + 1
+    st.session_state.remembered_count = recorded
+    if recorded % MEMORY_PRUNE_EVERY == 0:
+        memory.prune()
+
+def _conversation_context(user_input: str) -> str:
+    """The memory's summary and recent turns as prompt text, without the message being answered."""
+    memory = st.session_state.get("memory")
+    if memory is None:
+        return ""
+    messages = memory.load_memory_variables({})["chat_history"]
+    # add_message already recorded the message being answered; the prompt quotes it on its own
+    if messages and messages[-1].type == "human" and messages[-1].content == user_input:
+        messages = messages[:-1]
+    return "\n".join(f"{MEMORY_SPEAKERS.get(m.type, m.type)}: {m.content}" for m in messages)
+
+def _txn_fields(parsed: dict) -> dict:
+    """Narrow a Gemini parse result to the fields that are saved to the sheet."""
+    return {k: parsed.get(k) for k in TXN_FIELDS}
+
+def add_transaction_message(intro: str, txn: dict, reasoning: str = "", reasoning_label: str = "Perhitungan"):
+    add_message("bot", {
+        "intro": intro,
+        "txn": _txn_fields(txn),
+        "reasoning": reasoning,
+        "reasoning_label": reasoning_label
+    }, kind="transaction")
+
+def render_message(message: dict) -> str:
+    """Format a chat_history entry into the text shown in the chat bubble."""
+    payload = message["payload"]
+    if message["kind"] != "transaction":
+        return payload
+    txn = payload["txn"]
+    text = f"{payload['intro']}\n\nTanggal: {txn['date']}\nJumlah: Rp {txn['amount']:,.2f}\nTipe: {txn['type']}\nKategori: {txn['category']}\nCatatan: {txn['note']}"
+    if payload["reasoning"]:
+        text += f"\n\n{payload['reasoning_label']}: {payload['reasoning']}"
+    return text + "\n\nApakah Anda ingin menyimpannya?"
+
+def render_history():
+    # One markdown element for the whole history instead of one per message; text is escaped
+    # because it is injected as raw HTML
+    st.markdown("".join(
+        f'<div class="{"user-message" if message["role"] == "user" else "bot-message"}">'
+        f'{html.escape(render_message(message))}</div>'
+        for message in st.session_state.chat_history
+    ), unsafe_allow_html=True)
+
 def clear_chat():
-    st.session_state.chat_history = []
+    st.session_state.chat_history = deque(maxlen=CHAT_HISTORY_LIMIT)
     if "pending_transaction" in st.session_state:
         del st.session_state.pending_transaction
-    st.session_state.memory.clear()
+    if "memory" in st.session_state:
+        st.session_state.memory.clear()
+
+def _stream_reply(chunks, reply_box, user_input: str) -> str:
+    """Show a streamed bot reply under the user's message as it arrives; returns the full text."""
+    user_div = f'<div class="user-message">{html.escape(user_input)}</div>'
+    text = ""
+    for chunk in chunks:
+        text += chunk
+        reply_box.markdown(f'{user_div}<div class="bot-message">{html.escape(text)}</div>', unsafe_allow_html=True)
+    return text.strip()
 
-def process_user_input(user_input: str, gemini_client, data_analyzer):
+def _submit_with_ctx(fn, *args) -> Future:
+    """
+    Run fn on its own short-lived thread carrying this script run's context, so st.cache_* work
+    there. A fresh thread per call means no worker is left holding a finished (or another
+    session's) run context.
+    """
+    future = Future()
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+    thread = threading.Thread(target=run, name="prefetch", daemon=True)
+    add_script_run_ctx(thread, get_script_run_ctx())
+    thread.start()
+    return future
+
+def process_user_input(user_input: str, gemini_client, data_analyzer, reply_box):
     """
     Process user input and generate appropriate response with contextual memory.
+    Free-text replies are streamed into reply_box before being added to the history.
     """
     if not user_input:
         return
@@ -75,6 +404,9 @@ def process_user_input(user_input: str, gemini_client, data_analyzer):
     
     with st.spinner("Sedang memproses..."):
         try:
+            # Ringkasan dan giliran terakhir dari memory, untuk prompt klasifikasi dan percakapan
+            history = _conversation_context(user_input)
+            
             # Cek apakah ada transaksi yang sedang menunggu konfirmasi
             has_pending = "pending_transaction" in st.session_state
             
@@ -89,71 +421,258 @@ def process_user_input(user_input: str, gemini_client, data_analyzer):
                 
                 if intent == "update_transaction":
                     # AI menganggap ini adalah pembaruan
-                    st.session_state.pending_transaction = parsed_result
+                    st.session_state.pending_transaction = _txn_fields(parsed_result)
                     reasoning = parsed_result.get("reasoning", "")
                     
-                    st.session_state.chat_history.append({
-                        "role": "bot", 
-                        "text": f"Baik, saya perbarui transaksinya. Berikut detailnya:\n\nTanggal: {parsed_result['date']}\nJumlah: Rp {parsed_result['amount']:,.2f}\nTipe: {parsed_result['type']}\nKategori: {parsed_result['category']}\nCatatan: {parsed_result['note']}\n\nAlasan: {reasoning}\n\nApakah Anda ingin menyimpannya?"
-                    })
+                    add_transaction_message(
+                        "Baik, saya perbarui transaksinya. Berikut detailnya:",
+                        parsed_result, reasoning, reasoning_label="Alasan"
+                    )
                 elif intent == "new_transaction":
                     # AI menganggap ini transaksi baru, ganti yang lama
-                    st.session_state.chat_history.append({
-                        "role": "bot", 
-                        "text": "Oke, saya anggap ini transaksi baru. Transaksi sebelumnya saya abaikan ya."
-                    })
-                    st.session_state.pending_transaction = parsed_result
-                    st.session_state.chat_history.append({
-                        "role": "bot", 
-                        "text": f"Saya telah mengenali transaksi berikut:\n\nTanggal: {parsed_result['date']}\nJumlah: Rp {parsed_result['amount']:,.2f}\nTipe: {parsed_result['type']}\nKategori: {parsed_result['category']}\nCatatan: {parsed_result['note']}\n\nApakah Anda ingin menyimpannya?"
-                    })
+                    add_message("bot", "Oke, saya anggap ini transaksi baru. Transaksi sebelumnya saya abaikan ya.")
+                    st.session_state.pending_transaction = _txn_fields(parsed_result)
+                    add_transaction_message("Saya telah mengenali transaksi berikut:", parsed_result)
                 else: # conversation
-                    response = gemini_client.generate_friendly_response(user_input)
-                    st.session_state.chat_history.append({
-                        "role": "bot", 
-                        "text": response
-                    })
+                    response = _stream_reply(
+                        gemini_client.stream_friendly_response(user_input, history), reply_box, user_input
+                    )
+                    add_message("bot", response)
             else:
-                # Tidak ada transaksi pending, gunakan logika lama
-                is_transaction, is_data_query, reasoning, friendly_response = gemini_client.is_transaction(user_input)
-                add_debug(f"Is transaction: {is_transaction}, Is data query: {is_data_query}, Reasoning: {reasoning}")
+                # Tidak ada transaksi pending: pesan yang jelas diklasifikasi lokal, sisanya
+                # diklasifikasi dan di-parse dalam satu panggilan Gemini
+                local_intent = quick_intent(user_input)
+                summary_future = None
+                if local_intent:
+                    result = {"intent": local_intent, "reasoning": "local fast path"}
+                else:
+                    # Ringkasan data dibangun paralel dengan klasifikasi; hasilnya di-memo
+                    # analyzer, jadi tidak terbuang walau pesannya bukan data query
+                    if data_analyzer:
+                        summary_future = _submit_with_ctx(data_analyzer.get_data_summary)
+                    result = gemini_client.classify_and_parse(user_input, history)
+                intent = result.get("intent", "conversation")
+                add_debug(f"Intent: {intent}, Reasoning: {result.get('reasoning', '')}")
                 
-                if is_data_query and data_analyzer:
-                    data_summary = data_analyzer.get_data_summary()
-                    response = gemini_client.analyze_data_query(user_input, data_summary)
-                    st.session_state.chat_history.append({
-                        "role": "bot", 
-                        "text": response
-                    })
-                elif is_transaction:
-                    parsed_txn = gemini_client.parse_transaction(user_input)
+                if intent == "data_query" and data_analyzer:
+                    data_summary = summary_future.result() if summary_future else data_analyzer.get_data_summary()
+                    response = _stream_reply(gemini_client.stream_data_query(user_input, data_summary), reply_box, user_input)
+                    add_message("bot", response, kind="analysis")
+                elif intent == "transaction" and result.get("transaction"):
+                    parsed_txn = result["transaction"]
                     add_debug(f"Parsed transaction: {parsed_txn}")
                     
-                    reasoning = parsed_txn.get("reasoning", "")
-                    if reasoning:
-                        reasoning_text = f"\n\nPerhitungan: {reasoning}"
-                    else:
-                        reasoning_text = ""
-                    
-                    st.session_state.chat_history.append({
-                        "role": "bot", 
-                        "text": f"Saya telah mengenali transaksi berikut:\n\nTanggal: {parsed_txn['date']}\nJumlah: Rp {parsed_txn['amount']:,.2f}\nTipe: {parsed_txn['type']}\nKategori: {parsed_txn['category']}\nCatatan: {parsed_txn['note']}{reasoning_text}\n\nApakah Anda ingin menyimpannya?"
-                    })
+                    add_transaction_message(
+                        "Saya telah mengenali transaksi berikut:",
+                        parsed_txn, parsed_txn.get("reasoning", "")
+                    )
                     
-                    st.session_state.pending_transaction = parsed_txn
+                    st.session_state.pending_transaction = _txn_fields(parsed_txn)
                 else:
-                    response = gemini_client.generate_friendly_response(user_input)
-                    st.session_state.chat_history.append({
-                        "role": "bot", 
-                        "text": response
-                    })
+                    # The classification call already wrote a reply; only ask again if it left it empty
+                    response = result.get("response") or _stream_reply(
+                        gemini_client.stream_friendly_response(user_input, history), reply_box, user_input
+                    )
+                    add_message("bot", response)
         except Exception as e:
-            st.session_state.chat_history.append({
-                "role": "bot", 
-                "text": f"Maaf, saya tidak dapat memproses permintaan Anda. Error: {str(e)}"
-            })
+            add_message("bot", f"Maaf, saya tidak dapat memproses permintaan Anda. Error: {str(e)}")
             add_debug(f"Error processing request: {e}")
 
+def _set_state(**updates):
+    """on_click helper: apply session_state updates, then let Streamlit do its single rerun."""
+    for key, value in updates.items():
+        st.session_state[key] = value
+
+def _pop_state(key: str):
+    st.session_state.pop(key, None)
+
+def _change_page(delta: int, total_pages: int):
+    current = st.session_state.get("current_page", 1)
+    st.session_state.current_page = min(total_pages, max(1, current + delta))
+
+def _submit_example(query: str):
+    """on_click callback for the example-query buttons; the reply is produced in the chat area."""
+    add_message("user", query)
+    st.session_state.queued_input = query
+
+def _submit_chat():
+    """on_click callback for the chat form; runs before the form clears the input."""
+    # whitespace-only submits never reach Gemini
+    user_input = st.session_state.user_input.strip()
+    if not user_input:
+        # Output written in a callback lands at the top of the page; the main run shows it by the form
+        st.session_state.empty_input_warning = True
+        return
+    add_message("user", user_input)
+    st.session_state.queued_input = user_input
+
+@st.fragment
+def _transaction_editor(df: pd.DataFrame, sheets_client: SheetsClient, spreadsheet_id: str):
+    """Paginated table with edit/delete. Selection, paging and opening the edit form
+    rerun only this fragment; writes still rerun the whole app so totals and charts refresh."""
+    # Pagination settings
+    page_size = st.slider("Jumlah data per halaman", min_value=5, max_value=50, value=10, step=5)
+
+    # Get total number of pages
+    total_rows = len(df)
+    total_pages = max(1, (total_rows + page_size - 1) // page_size)
+
+    # Fix: ensure current_page is valid
+    if "current_page" not in st.session_state:
+        st.session_state.current_page = 1
+    elif st.session_state.current_page > total_pages:
+        st.session_state.current_page = total_pages
+    elif st.session_state.current_page < 1:
+        st.session_state.current_page = 1
+
+    # Page selection
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        st.button(
+            "⬅️ Halaman Sebelumnya",
+            disabled=st.session_state.get("current_page", 1) <= 1,
+            on_click=_change_page,
+            args=(-1, total_pages)
+        )
+
+    with col2:
+        current_page = st.number_input(
+                            "Halaman",
+                            min_value=1,
+                            max_value=total_pages,
+                            value=min(st.session_state.get("current_page", 1), total_pages),
+                            step=1
+                        )
+        st.session_state.current_page = current_page
+
+    with col3:
+        st.button(
+            "Halaman Berikutnya ➡️",
+            disabled=st.session_state.get("current_page", 1) >= total_pages,
+            on_click=_change_page,
+            args=(1, total_pages)
+        )
+
+    # Display page info
+    st.info(f"Menampilkan halaman {current_page} dari {total_pages} (Total {total_rows} transaksi)")
+
+    # Slice the current page out of the (already sorted) cached dataframe and send only
+    # the columns the table shows; long notes are cut to a preview (the edit form has the full text)
+    start_idx = (current_page - 1) * page_size
+    page_df = df.iloc[start_idx:start_idx + page_size]
+    notes = page_df['note'].astype(str)
+    display_df = page_df[list(TABLE_COLUMNS)].assign(note=notes.where(
+        notes.str.len() <= NOTE_PREVIEW_CHARS, notes.str[:NOTE_PREVIEW_CHARS - 1] + "…"
+    ))
+
+    # Display the dataframe with selection
+    st.markdown("### Pilih transaksi untuk diedit atau dihapus:")
+    selected_rows = st.dataframe(
+        display_df.style.format({'amount': lambda v: f"Rp {format_amount(v)}"}),
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            "date": st.column_config.DateColumn("date", format="YYYY-MM-DD"),
+            "note": st.column_config.TextColumn("note", width="medium"),
+        },
+        selection_mode="single-row",
+        on_select="rerun",
+        key="data_selection"
+    )
+
+    # Get selected row index
+    selected_row_index = None
+    if selected_rows and selected_rows["selection"]["rows"]:
+        # The dataframe index is the Google Sheets row number (see get_transactions_df)
+        selected_row_in_page = selected_rows["selection"]["rows"][0]
+        # A selection kept from before a delete or refresh can point past the end of the page
+        if selected_row_in_page < len(display_df):
+            selected_row_index = int(display_df.index[selected_row_in_page])
+
+    # Action buttons
+    if selected_row_index:
+        st.markdown('<div class="action-buttons">', unsafe_allow_html=True)
+        col_edit, col_delete = st.columns(2)
+        with col_edit:
+            st.button(
+                "✏️ Edit",
+                key="edit_button",
+                on_click=_set_state,
+                kwargs={"edit_mode": True, "edit_row_index": selected_row_index}
+            )
+        with col_delete:
+            if st.button("🗑️ Hapus", key="delete_button"):
+                try:
+                    sheets_client.delete_transaction(selected_row_index)
+                    invalidate_tx_cache(spreadsheet_id)
+                    st.markdown('<div class="success-message">Transaksi berhasil dihapus! ✅</div>', unsafe_allow_html=True)
+                    st.rerun(scope="app")
+                except Exception as e:
+                    st.markdown(f'<div class="error-message">Gagal menghapus: {e}</div>', unsafe_allow_html=True)
+                    add_debug(f"Error deleting transaction: {e}")
+        st.markdown('</div>', unsafe_allow_html=True)
+
+    # Edit form; a row that is gone since the edit started (deleted, sheet re-read) just closes it
+    if st.session_state.edit_mode and st.session_state.edit_row_index not in df.index:
+        st.session_state.edit_mode = False
+        st.session_state.edit_row_index = None
+    if st.session_state.edit_mode and st.session_state.edit_row_index:
+        st.markdown('<div class="edit-form">', unsafe_allow_html=True)
+        st.markdown("### Edit Transaksi")
+    
+        # Get the row data
+        row_data = df.loc[st.session_state.edit_row_index]
+    
+        with st.form("edit_txn"):
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                edit_date = st.date_input("Tanggal", value=row_data['date'].date())
+                edit_category = st.selectbox(
+                    "Kategori", 
+                    CATEGORIES,
+                    index=CAT_INDEX.get(row_data['category'], 0)
+                )
+            with col2:
+                edit_amount = st.text_input("Jumlah", value=str(row_data['amount']))
+                edit_type = st.selectbox(
+                    "Tipe", 
+                    TYPES,
+                    index=TYPE_INDEX.get(row_data['type'], 0)
+                )
+            with col3:
+                edit_note = st.text_area("Catatan / Deskripsi", value=row_data['note'], height=100)
+    
+            col_save, col_cancel = st.columns(2)
+            with col_save:
+                if st.form_submit_button("Simpan Perubahan", type="primary"):
+                    try:
+                        amount_val = parse_amount(edit_amount)
+                        updated_txn = {
+                            "date": edit_date.isoformat(),
+                            "amount": amount_val,
+                            "type": edit_type,
+                            "category": normalize_category(edit_category),
+                            "note": edit_note
+                        }
+                        sheets_client.update_transaction(st.session_state.edit_row_index, updated_txn)
+                        invalidate_tx_cache(spreadsheet_id)
+                        st.markdown('<div class="success-message">Transaksi berhasil diperbarui! ✅</div>', unsafe_allow_html=True)
+                        st.session_state.edit_mode = False
+                        st.session_state.edit_row_index = None
+                        st.rerun(scope="app")
+                    except Exception as e:
+                        st.markdown(f'<div class="error-message">Gagal memperbarui: {e}</div>', unsafe_allow_html=True)
+                        add_debug(f"Error updating transaction: {e}")
+            with col_cancel:
+                st.form_submit_button(
+                    "Batal",
+                    on_click=_set_state,
+                    kwargs={"edit_mode": False, "edit_row_index": None}
+                )
+    
+        st.markdown('</div>', unsafe_allow_html=True)
+
+
 def show_spreadsheet_setup():
     """Display the spreadsheet setup page with user-defined names."""
 
@@ -161,7 +680,7 @@ def show_spreadsheet_setup():
     db = st.session_state.get("db")
     user = st.session_state.get("user")
     if db and user:
-        spreadsheets = db.get_user_spreadsheets(user['id'])
+        spreadsheets = _user_sheets(db, user['id'])
         if spreadsheets:
             st.title("Spreadsheet Anda")
             for sheet in spreadsheets:
@@ -169,18 +688,20 @@ def show_spreadsheet_setup():
                 with col1:
                     st.markdown(f"- **{sheet['spreadsheet_name']}**")
                 with col2:
-                    if st.button("Gunakan", key=f"use_sheet_{sheet['id']}"):
-                        st.session_state["spreadsheet_id"] = sheet['spreadsheet_id']
-                        st.rerun()
+                    st.button(
+                        "Gunakan",
+                        key=f"use_sheet_{sheet['id']}",
+                        on_click=_set_state,
+                        kwargs={"spreadsheet_id": sheet['spreadsheet_id']}
+                    )
                 # --- PERBAIKAN DIMULAI DI SINI ---
                 with col3:
                     if st.button("Hapus", key=f"delete_sheet_{sheet['id']}"):
                         if st.session_state.get("spreadsheet_id") == sheet['spreadsheet_id']:
                             st.warning("Anda sedang menggunakan spreadsheet ini. Pilih spreadsheet lain sebelum menghapus.")
                         else:
-                            # Hanya setel flag konfirmasi, jangan lakukan apa-apa lagi
+                            # Hanya setel flag konfirmasi; dialog di bawah langsung tampil di run ini
                             st.session_state[f"confirm_delete_{sheet['id']}"] = True
-                            st.rerun()
 
                 # Tampilkan dialog konfirmasi jika flag-nya aktif
                 if st.session_state.get(f"confirm_delete_{sheet['id']}", False):
@@ -191,6 +712,7 @@ def show_spreadsheet_setup():
                             if st.button("Ya, Hapus", key=f"confirm_yes_{sheet['id']}", type="primary"):
                                 # --- LOGIKA HAPUS YANG SEBENARNYA ADA DI SINI ---
                                 if db.delete_spreadsheet(user['id'], sheet['spreadsheet_id']):
+                                    _user_sheets.clear()
                                     st.success(f"Spreadsheet '{sheet['spreadsheet_name']}' telah dihapus.")
                                     # Hapus flag konfirmasi dari session state
                                     del st.session_state[f"confirm_delete_{sheet['id']}"]
@@ -198,10 +720,13 @@ def show_spreadsheet_setup():
                                 else:
                                     st.error("Gagal menghapus spreadsheet. Silakan coba lagi.")
                         with col_cancel:
-                            if st.button("Batal", key=f"confirm_no_{sheet['id']}"):
-                                # Hapus flag konfirmasi dari session state
-                                del st.session_state[f"confirm_delete_{sheet['id']}"]
-                                st.rerun()
+                            # Hapus flag konfirmasi dari session state
+                            st.button(
+                                "Batal",
+                                key=f"confirm_no_{sheet['id']}",
+                                on_click=_pop_state,
+                                args=(f"confirm_delete_{sheet['id']}",)
+                            )
 
     st.title("Setup Google Sheets")
     
@@ -255,6 +780,7 @@ def show_spreadsheet_setup():
                     user = st.session_state.get("user")
                     if db and user:
                         if db.add_spreadsheet(user['id'], spreadsheet_id, spreadsheet_name):
+                            _user_sheets.clear()
                             st.success(f"Spreadsheet '{spreadsheet_name}' berhasil dihubungkan!")
                             st.session_state["spreadsheet_id"] = spreadsheet_id
                             st.rerun()
@@ -271,120 +797,8 @@ def main():
         initial_sidebar_state="expanded"
     )
     
-    # Add custom CSS
-    st.markdown("""
-    <style>
-        .main-header {
-            font-size: 2.5rem;
-            color: #1f77b4;
-            text-align: center;
-            margin-bottom: 1rem;
-        }
-        .sub-header {
-            font-size: 1.5rem;
-            color: #2ca02c;
-            margin-top: 1rem;
-            margin-bottom: 0.5rem;
-        }
-        .success-message {
-            padding: 1rem;
-            background-color: #d4edda;
-            border-radius: 0.5rem;
-            color: #155724;
-            margin: 1rem 0;
-        }
-        .error-message {
-            padding: 1rem;
-            background-color: #f8d7da;
-            border-radius: 0.5rem;
-            color: #721c24;
-            margin: 1rem 0;
-        }
-        .info-message {
-            padding: 1rem;
-            background-color: #d1ecf1;
-            border-radius: 0.5rem;
-            color: #0c5460;
-            margin: 1rem 0;
-        }
-        .chat-container {
-            background-color: #f8f9fa;
-            border-radius: 0.5rem;
-            padding: 1rem;
-            margin-bottom: 1rem;
-        }
-        .user-message {
-            background-color: #e3f2fd;
-            padding: 0.5rem 1rem;
-            border-radius: 1rem 1rem 0 1rem;
-            margin-bottom: 0.5rem;
-            max-width: 80%;
-        }
-        .bot-message {
-            background-color: #e8f5e9;
-            padding: 0.5rem 1rem;
-            border-radius: 1rem 1rem 1rem 0;
-            margin-bottom: 0.5rem;
-            max-width: 80%;
-            margin-left: auto;
-        }
-        .transaction-card {
-            background-color: white;
-            border-radius: 0.5rem;
-            padding: 1rem;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-            margin-bottom: 1rem;
-        }
-        .category-food { color: #ff7f0e; }
-        .category-transport { color: #1f77b4; }
-        .category-shopping { color: #9467bd; }
-        .category-bills { color: #d62728; }
-        .category-entertainment { color: #8c564b; }
-        .category-health { color: #e377c2; }
-        .category-education { color: #7f7f7f; }
-        .category-income { color: #2ca02c; }
-        .category-uncategorized { color: #17becf; }
-        .clear-chat-btn {
-            background-color: #dc3545;
-            color: white;
-            border: none;
-            padding: 0.5rem 1rem;
-            border-radius: 0.25rem;
-            cursor: pointer;
-            margin-top: 0.5rem;
-        }
-        .action-buttons {
-            display: flex;
-            gap: 0.5rem;
-            margin-top: 0.5rem;
-        }
-        .edit-form {
-            background-color: #f8f9fa;
-            padding: 1rem;
-            border-radius: 0.5rem;
-            margin-top: 1rem;
-        }
-        .query-examples {
-            background-color: #f8f9fa;
-            border-radius: 0.5rem;
-            padding: 1rem;
-            margin-bottom: 1rem;
-        }
-        .example-query {
-            background-color: #e9ecef;
-            border-radius: 0.25rem;
-            padding: 0.5rem;
-            margin: 0.25rem 0;
-            cursor: pointer;
-            text-align: left;
-            border: none;
-            width: 100%;
-        }
-        .example-query:hover {
-            background-color: #dee2e6;
-        }
-    </style>
-    """, unsafe_allow_html=True)
+    # Add custom CSS (read once, then served from cache)
+    st.markdown(_style_tag(), unsafe_allow_html=True)
     
     initialize_state()
     
@@ -424,9 +838,7 @@ def main():
         spreadsheet_id = st.session_state.get("spreadsheet_id")
         if spreadsheet_id:
             st.markdown(f"**Spreadsheet ID:** {spreadsheet_id[:10]}...")
-            if st.button("Change Spreadsheet"):
-                del st.session_state["spreadsheet_id"]
-                st.rerun()
+            st.button("Change Spreadsheet", on_click=_pop_state, args=("spreadsheet_id",))
         
         # st.markdown("---")
         
@@ -446,7 +858,8 @@ def main():
     #     st.error("Gemini API Key is required. Please provide it in the sidebar.")
     #     return
     
-    gemini_client = GeminiClient(api_key=gemini_api_key)
+    # On a cold start the Gemini client (and the LangChain import) is built while Sheets authenticates
+    gemini_future = _submit_with_ctx(_gemini, gemini_api_key)
 
     # Sheets client (connect lazily to avoid failures on load)
     sheets_client = None
@@ -456,12 +869,9 @@ def main():
     # Kembali menggunakan GOOGLE_SHEETS_JSON
     if GOOGLE_SHEETS_JSON and spreadsheet_id:
         try:
-            sheets_client = SheetsClient(
-                credentials_string=GOOGLE_SHEETS_JSON, 
-                spreadsheet_id=spreadsheet_id, 
-                sheet_name=SHEET_NAME
-            )
-            data_analyzer = DataAnalyzer(sheets_client)
+            creds_hash = hashlib.sha1(GOOGLE_SHEETS_JSON.encode()).hexdigest()
+            sheets_client = _get_sheets(spreadsheet_id, SHEET_NAME, creds_hash)
+            data_analyzer = _get_analyzer(spreadsheet_id, SHEET_NAME, creds_hash)
             add_debug("Successfully connected to Google Sheets")
         except Exception as e:
             st.warning(f"Cannot connect to Google Sheets: {e}")
@@ -471,6 +881,17 @@ def main():
         if not GOOGLE_SHEETS_JSON:
             st.error("Google Sheets credentials not found. Please set GOOGLE_SHEETS_JSON in your .env file.")
     
+    gemini_client = gemini_future.result()
+
+    # Older turns are summarized by Gemini so the context passed to the prompts stays bounded
+    if "memory" not in st.session_state:
+        from langchain.memory import ConversationSummaryBufferMemory
+        st.session_state.memory = ConversationSummaryBufferMemory(
+            llm=gemini_client.model,
+            max_token_limit=512,
+            memory_key="chat_history",
+            return_messages=True
+        )
 
     # Chat interface
     st.markdown('<h2 class="sub-header">💬 Chat Interface</h2>', unsafe_allow_html=True)
@@ -478,75 +899,61 @@ def main():
     # Clear chat button
     col1, col2 = st.columns([1, 9])
     with col1:
-        if st.button("Bersihkan Chat", type="secondary"):
-            clear_chat()
-            st.rerun()
+        st.button("Bersihkan Chat", type="secondary", on_click=clear_chat)
     
     # Example queries
     if data_analyzer:
         st.markdown('<div class="query-examples">', unsafe_allow_html=True)
         st.markdown("### Contoh Pertanyaan Data:")
         
-        example_queries = [
-            "Berapa total pengeluaran saya bulan ini?",
-            "Apa kategori pengeluaran terbesar saya?",
-            "Berapa pengeluaran saya untuk makanan bulan ini?",
-            "Tunjukkan transaksi terkait 'transport'",
-            "Berapa pemasukan vs pengeluaran saya 3 bulan terakhir?",
-            "Apa saja transaksi terbesar saya?"
-        ]
-        
-        for query in example_queries:
-            if st.button(query, key=f"example_{query}"):
-                st.session_state.chat_history.append({"role": "user", "text": query})
-                # Process the query immediately
-                process_user_input(query, gemini_client, data_analyzer)
-                st.rerun()
+        for i, query in enumerate(EXAMPLE_QUERIES):
+            st.button(
+                query,
+                key=f"example_{i}",
+                on_click=_submit_example,
+                args=(query,)
+            )
         
         st.markdown('</div>', unsafe_allow_html=True)
     
-    # Display chat history
+    # Display chat history. A message queued by the callbacks is answered first, so a streamed
+    # reply shows up below the history while it arrives; the history is drawn once it is stored.
     chat_container = st.container()
+    reply_box = st.empty()
+    queued_input = st.session_state.pop("queued_input", None)
+    if queued_input:
+        process_user_input(queued_input, gemini_client, data_analyzer, reply_box)
+        reply_box.empty()
     with chat_container:
-        for message in st.session_state.chat_history:
-            if message["role"] == "user":
-                st.markdown(f'<div class="user-message">{message["text"]}</div>', unsafe_allow_html=True)
-            else:
-                st.markdown(f'<div class="bot-message">{message["text"]}</div>', unsafe_allow_html=True)
+        render_history()
     
-    # Chat input
-    user_input = st.text_input("Ketik perintah, deskripsi pengeluaran/pemasukan, atau pertanyaan tentang data Anda", key="user_input")
-    
-    col1, col2 = st.columns([1, 5])
-    with col1:
-        if st.button("Kirim", type="primary"):
-            if not user_input:
-                st.warning("Masukkan teks dulu.")
-            else:
-                st.session_state.chat_history.append({"role": "user", "text": user_input})
-                # Process the input
-                process_user_input(user_input, gemini_client, data_analyzer)
-                st.rerun()
+    # Chat input: inside a form the script only reruns on submit, not on every edit
+    with st.form("chat_form", clear_on_submit=True):
+        st.text_input("Ketik perintah, deskripsi pengeluaran/pemasukan, atau pertanyaan tentang data Anda", key="user_input")
+        st.form_submit_button(
+            "Kirim",
+            type="primary",
+            on_click=_submit_chat
+        )
+    if st.session_state.pop("empty_input_warning", False):
+        st.warning("Masukkan teks dulu.")
     
     # Confirm transaction button
     if "pending_transaction" in st.session_state:
-        with col2:
-            if st.button("Simpan Transaksi", type="secondary"):
-                if not sheets_client:
-                    st.error("Google Sheets belum terkonfigurasi atau gagal koneksi.")
-                else:
-                    try:
-                        sheets_client.append_transaction(st.session_state.pending_transaction)
-                        st.markdown('<div class="success-message">Transaksi berhasil disimpan! ✅</div>', unsafe_allow_html=True)
-                        st.session_state.chat_history.append({
-                            "role": "bot", 
-                            "text": "Transaksi berhasil disimpan ke Google Sheets!"
-                        })
-                        del st.session_state.pending_transaction
-                        st.rerun()
-                    except Exception as e:
-                        st.markdown(f'<div class="error-message">Gagal menyimpan: {e}</div>', unsafe_allow_html=True)
-                        add_debug(f"Error saving transaction: {e}")
+        if st.button("Simpan Transaksi", type="secondary"):
+            if not sheets_client:
+                st.error("Google Sheets belum terkonfigurasi atau gagal koneksi.")
+            else:
+                try:
+                    sheets_client.append_transaction(st.session_state.pending_transaction)
+                    invalidate_tx_cache(spreadsheet_id)
+                    st.markdown('<div class="success-message">Transaksi berhasil disimpan! ✅</div>', unsafe_allow_html=True)
+                    add_message("bot", "Transaksi berhasil disimpan ke Google Sheets!")
+                    del st.session_state.pending_transaction
+                    st.rerun()
+                except Exception as e:
+                    st.markdown(f'<div class="error-message">Gagal menyimpan: {e}</div>', unsafe_allow_html=True)
+                    add_debug(f"Error saving transaction: {e}")
     
     st.markdown("---")
     
@@ -557,10 +964,10 @@ def main():
         col1, col2, col3 = st.columns(3)
         with col1:
             date_in = st.date_input("Tanggal", value=datetime.now().date())
-            category_in = st.selectbox("Kategori", ["food", "transport", "shopping", "bills", "entertainment", "health", "education", "income", "uncategorized"])
+            category_in = st.selectbox("Kategori", CATEGORIES)
         with col2:
             amount_in = st.text_input("Jumlah (contoh: 50k, 50000)", value="")
-            type_in = st.selectbox("Tipe", ["expense", "income"])
+            type_in = st.selectbox("Tipe", TYPES)
         with col3:
             note_in = st.text_area("Catatan / Deskripsi", height=100)
         
@@ -581,6 +988,7 @@ def main():
                     st.markdown('<div class="error-message">Google Sheets belum terkonfigurasi atau gagal koneksi.</div>', unsafe_allow_html=True)
                 else:
                     sheets_client.append_transaction(txn)
+                    invalidate_tx_cache(spreadsheet_id)
                     st.markdown('<div class="success-message">Transaksi berhasil disimpan ke Google Sheets! ✅</div>', unsafe_allow_html=True)
             except Exception as e:
                 st.markdown(f'<div class="error-message">Gagal menambahkan transaksi: {e}</div>', unsafe_allow_html=True)
@@ -593,247 +1001,42 @@ def main():
     
     if sheets_client:
         try:
-            df = sheets_client.get_transactions_df()
+            version, df = load_tx_df(sheets_client, spreadsheet_id)
             if df.empty:
                 st.markdown('<div class="info-message">Belum ada transaksi.</div>', unsafe_allow_html=True)
             else:
                 # Summary statistics
+                totals = tx_totals(spreadsheet_id, version, df)
+                total_income = totals["income"]
+                total_expense = totals["expense"]
                 col1, col2, col3, col4 = st.columns(4)
                 with col1:
-                    total_income = df[df['type'] == 'income']['amount'].sum()
-                    st.metric("Total Pemasukan", f"Rp {format_amount(total_income)}")
+                    st.metric("Total Pemasukan", totals["income_fmt"])
                 with col2:
-                    total_expense = df[df['type'] == 'expense']['amount'].sum()
-                    st.metric("Total Pengeluaran", f"Rp {format_amount(total_expense)}")
+                    st.metric("Total Pengeluaran", totals["expense_fmt"])
                 with col3:
-                    balance = total_income - total_expense
-                    st.metric("Saldo", f"Rp {format_amount(balance)}")
+                    st.metric("Saldo", totals["balance_fmt"])
                 with col4:
                     transaction_count = len(df)
                     st.metric("Jumlah Transaksi", f"{transaction_count}")
                 
                 # Tabs for different views
+                _plotly_json_engine()
                 tab1, tab2, tab3 = st.tabs(["📋 Data Tabel", "📈 Visualisasi", "🔍 Analisis"])
                 
                 with tab1:
-                    # Pagination settings
-                    page_size = st.slider("Jumlah data per halaman", min_value=5, max_value=50, value=10, step=5)
-                    
-                    # Get total number of pages
-                    total_rows = len(df)
-                    total_pages = max(1, (total_rows + page_size - 1) // page_size)
-                    
-                    # Fix: ensure current_page is valid
-                    if "current_page" not in st.session_state:
-                        st.session_state.current_page = 1
-                    elif st.session_state.current_page > total_pages:
-                        st.session_state.current_page = total_pages
-                    elif st.session_state.current_page < 1:
-                        st.session_state.current_page = 1
-                    
-                    # Page selection
-                    col1, col2, col3 = st.columns([1, 2, 1])
-                    with col1:
-                        if st.button("⬅️ Halaman Sebelumnya", disabled=st.session_state.get("current_page", 1) <= 1):
-                            st.session_state.current_page = max(1, st.session_state.get("current_page", 1) - 1)
-                            st.rerun()
-                    
-                    with col2:
-                        current_page = st.number_input(
-                                            "Halaman",
-                                            min_value=1,
-                                            max_value=total_pages,
-                                            value=min(st.session_state.get("current_page", 1), total_pages),
-                                            step=1
-                                        )
-                        st.session_state.current_page = current_page
-                    
-                    with col3:
-                        if st.button("Halaman Berikutnya ➡️", disabled=st.session_state.get("current_page", 1) >= total_pages):
-                            st.session_state.current_page = min(total_pages, st.session_state.get("current_page", 1) + 1)
-                            st.rerun()
-                    
-                    # Display page info
-                    st.info(f"Menampilkan halaman {current_page} dari {total_pages} (Total {total_rows} transaksi)")
-                    
-                    # Get paginated data
-                    paginated_df = paginate_dataframe(df, page_size, current_page)
-                    
-                    # Create a copy of the paginated dataframe for display (without timestamp)
-                    display_df = paginated_df.copy().drop(columns=['timestamp'], errors='ignore')
-                    
-                    # Add row numbers for selection (starting from 2 to account for header in Google Sheets)
-                    # We need to calculate the actual row indices in the original dataframe
-                    start_idx = (current_page - 1) * page_size
-                    display_df = display_df.reset_index(drop=True)
-                    display_df.index = display_df.index + start_idx + 2  # +2 because Google Sheets rows start at 1 and header is at row 1
-                    
-                    # Display the dataframe with selection
-                    st.markdown("### Pilih transaksi untuk diedit atau dihapus:")
-                    selected_rows = st.dataframe(
-                        display_df,
-                        use_container_width=True,
-                        hide_index=True,
-                        selection_mode="single-row",
-                        on_select="rerun",
-                        key="data_selection"
-                    )
-                    
-                    # Get selected row index
-                    selected_row_index = None
-                    if selected_rows and selected_rows["selection"]["rows"]:
-                        # Convert the selected row index in the paginated view to the actual row index in the original dataframe
-                        selected_row_in_page = selected_rows["selection"]["rows"][0]
-                        selected_row_index = start_idx + selected_row_in_page + 2  # Convert to Google Sheets row index
-                    
-                    # Action buttons
-                    if selected_row_index:
-                        st.markdown('<div class="action-buttons">', unsafe_allow_html=True)
-                        col_edit, col_delete = st.columns(2)
-                        with col_edit:
-                            if st.button("✏️ Edit", key="edit_button"):
-                                st.session_state.edit_mode = True
-                                st.session_state.edit_row_index = selected_row_index
-                                st.rerun()
-                        with col_delete:
-                            if st.button("🗑️ Hapus", key="delete_button"):
-                                try:
-                                    sheets_client.delete_transaction(selected_row_index)
-                                    st.markdown('<div class="success-message">Transaksi berhasil dihapus! ✅</div>', unsafe_allow_html=True)
-                                    st.rerun()
-                                except Exception as e:
-                                    st.markdown(f'<div class="error-message">Gagal menghapus: {e}</div>', unsafe_allow_html=True)
-                                    add_debug(f"Error deleting transaction: {e}")
-                        st.markdown('</div>', unsafe_allow_html=True)
-                    
-                    # Edit form
-                    if st.session_state.edit_mode and st.session_state.edit_row_index:
-                        st.markdown('<div class="edit-form">', unsafe_allow_html=True)
-                        st.markdown("### Edit Transaksi")
-                        
-                        # Get the row data
-                        row_data = df.iloc[st.session_state.edit_row_index - 2]  # -2 because of header and 0-based index
-                        
-                        with st.form("edit_txn"):
-                            col1, col2, col3 = st.columns(3)
-                            with col1:
-                                edit_date = st.date_input("Tanggal", value=pd.to_datetime(row_data['date']).date())
-                                edit_category = st.selectbox(
-                                    "Kategori", 
-                                    ["food", "transport", "shopping", "bills", "entertainment", "health", "education", "income", "uncategorized"],
-                                    index=["food", "transport", "shopping", "bills", "entertainment", "health", "education", "income", "uncategorized"].index(row_data['category']) if row_data['category'] in ["food", "transport", "shopping", "bills", "entertainment", "health", "education", "income", "uncategorized"] else 0
-                                )
-                            with col2:
-                                edit_amount = st.text_input("Jumlah", value=str(row_data['amount']))
-                                edit_type = st.selectbox(
-                                    "Tipe", 
-                                    ["expense", "income"],
-                                    index=0 if row_data['type'] == 'expense' else 1
-                                )
-                            with col3:
-                                edit_note = st.text_area("Catatan / Deskripsi", value=row_data['note'], height=100)
-                            
-                            col_save, col_cancel = st.columns(2)
-                            with col_save:
-                                if st.form_submit_button("Simpan Perubahan", type="primary"):
-                                    try:
-                                        amount_val = parse_amount(edit_amount)
-                                        updated_txn = {
-                                            "date": edit_date.isoformat(),
-                                            "amount": amount_val,
-                                            "type": edit_type,
-                                            "category": normalize_category(edit_category),
-                                            "note": edit_note
-                                        }
-                                        sheets_client.update_transaction(st.session_state.edit_row_index, updated_txn)
-                                        st.markdown('<div class="success-message">Transaksi berhasil diperbarui! ✅</div>', unsafe_allow_html=True)
-                                        st.session_state.edit_mode = False
-                                        st.session_state.edit_row_index = None
-                                        st.rerun()
-                                    except Exception as e:
-                                        st.markdown(f'<div class="error-message">Gagal memperbarui: {e}</div>', unsafe_allow_html=True)
-                                        add_debug(f"Error updating transaction: {e}")
-                            with col_cancel:
-                                if st.form_submit_button("Batal"):
-                                    st.session_state.edit_mode = False
-                                    st.session_state.edit_row_index = None
-                                    st.rerun()
-                        
-                        st.markdown('</div>', unsafe_allow_html=True)
-                
+                    _transaction_editor(df, sheets_client, spreadsheet_id)
+
                 with tab2:
-                    # Category breakdown
-                    cat_sum = df.groupby("category")["amount"].sum().sort_values(ascending=False)
-                    
-                    # Create subplots
-                    fig = make_subplots(
-                        rows=2, cols=2,
-                        subplot_titles=("Pengeluaran per Kategori", "Pemasukan vs Pengeluaran", "Transaksi per Hari", "Distribusi Kategori"),
-                        specs=[[{"type": "bar"}, {"type": "pie"}],
-                               [{"type": "scatter"}, {"type": "bar"}]]
-                    )
-                    
-                    # Expense by category
-                    expense_by_cat = df[df['type'] == 'expense'].groupby("category")["amount"].sum().sort_values(ascending=False)
-                    fig.add_trace(
-                        go.Bar(x=expense_by_cat.index, y=expense_by_cat.values, name="Pengeluaran"),
-                        row=1, col=1
-                    )
-                    
-                    # Income vs Expense
-                    fig.add_trace(
-                        go.Pie(labels=["Pemasukan", "Pengeluaran"], 
-                               values=[total_income, total_expense],
-                               hole=0.3),
-                        row=1, col=2
-                    )
-                    
-                    # Transactions per day
-                    daily_count = df.groupby('date').size().reset_index(name='count')
-                    # Convert date to string for proper serialization
-                    daily_count['date'] = daily_count['date'].astype(str)
-                    fig.add_trace(
-                        go.Scatter(x=daily_count['date'], y=daily_count['count'], mode='lines+markers', name="Transaksi/Hari"),
-                        row=2, col=1
-                    )
-                    
-                    # Category distribution
-                    fig.add_trace(
-                        go.Bar(x=cat_sum.index, y=cat_sum.values, name="Total per Kategori"),
-                        row=2, col=2
-                    )
-                    
-                    fig.update_layout(height=800, showlegend=False)
-                    st.plotly_chart(fig, use_container_width=True)
+                    st.plotly_chart(build_dashboard_fig(spreadsheet_id, version, df, total_income, total_expense), use_container_width=True)
                 
                 with tab3:
-                    # Monthly trend - FIXED: Convert to datetime instead of Period
-                    df['date'] = pd.to_datetime(df['date'])
-                    # Use the first day of each month instead of Period objects
-                    df['month'] = df['date'].dt.to_period('M').dt.to_timestamp()
-                    monthly_summary = df.groupby(['month', 'type'])['amount'].sum().unstack().fillna(0)
-                    
                     st.markdown("### Tren Bulanan")
-                    fig = px.line(
-                        monthly_summary.reset_index(), 
-                        x='month', 
-                        y=['expense', 'income'],
-                        labels={'value': 'Jumlah (Rp)', 'month': 'Bulan'},
-                        title="Pemasukan vs Pengeluaran per Bulan"
-                    )
-                    st.plotly_chart(fig, use_container_width=True)
+                    st.plotly_chart(build_monthly_fig(spreadsheet_id, version, df), use_container_width=True)
                     
                     # Top spending categories
                     st.markdown("### Kategori Pengeluaran Teratas")
-                    top_expense = df[df['type'] == 'expense'].groupby("category")["amount"].sum().sort_values(ascending=False).head(10)
-                    fig = px.bar(
-                        x=top_expense.values, 
-                        y=top_expense.index,
-                        orientation='h',
-                        labels={'x': 'Jumlah (Rp)', 'y': 'Kategori'},
-                        title="10 Kategori Pengeluaran Teratas"
-                    )
-                    st.plotly_chart(fig, use_container_width=True)
+                    st.plotly_chart(build_top_expense_fig(spreadsheet_id, version, df), use_container_width=True)
         except Exception as e:
             # st.markdown(f'<div class="error-message">Gagal memuat data: {e}</div>', unsafe_allow_html=True)
             add_debug(f"Error loading data: {e}")
@@ -844,8 +1047,7 @@ def main():
     if st.session_state.debug_mode:
         st.markdown("---")
         st.markdown('<h2 class="sub-header">🐛 Debug Log</h2>', unsafe_allow_html=True)
-        for line in st.session_state.debug_logs[-50:]:
-            st.text(line)
+        st.code("\n".join(list(st.session_state.debug_logs)[-50:]), language=None)
 
     st.markdown("---")
     st.markdown('<p style="text-align: center; color: #6c757d;">Mabot : AI Gemini Finance Chatbot 2025</p>', unsafe_allow_html=True)
@@ -0,0 +1,78 @@
+import math
+
+import pandas as pd
+import pytest
+
+from utils import ParseError, parse_amount, parse_amount_series, quick_intent
+
+AMOUNTS = [
+    ("1000", 1000.0),
+    ("50.000", 50000.0),
+    ("Rp 50.000", 50000.0),
+    ("1.200.000", 1200000.0),
+    ("Rp 1.200.000", 1200000.0),
+    ("1,200,000", 1200000.0),
+    ("1,200.50", 1200.5),
+    ("1.200,50", 1200.5),
+    ("12,5", 12.5),
+    ("1.5", 1.5),
+    ("12.50", 12.5),
+    ("-5000", -5000.0),
+    ("50k", 50000.0),
+    ("50K", 50000.0),
+    ("kopi 50k", 50000.0),
+    ("25rb", 25000.0),
+    ("25 ribu", 25000.0),
+    ("Rp. 50rb", 50000.0),
+    ("1,5jt", 1500000.0),
+    ("3.5jt", 3500000.0),
+    ("2 juta rupiah", 2000000.0),
+    ("50k.", 50000.0),
+    ("50k aja", 50000.0),
+    ("25rb ya", 25000.0),
+    ("Rp 1,5 jt untuk sewa", 1500000.0),
+    ("50 kopi", 50.0),
+]
+
+
+@pytest.mark.parametrize("text, expected", AMOUNTS)
+def test_parse_amount(text, expected):
+    assert parse_amount(text) == expected
+
+
+@pytest.mark.parametrize("text", ["", "abc"])
+def test_parse_amount_rejects_non_numbers(text):
+    with pytest.raises(ParseError):
+        parse_amount(text)
+
+
+def test_parse_amount_series_matches_scalar():
+    texts = [text for text, _ in AMOUNTS]
+    parsed = parse_amount_series(pd.Series(texts, index=range(10, 10 + len(texts))))
+    assert parsed.tolist() == [expected for _, expected in AMOUNTS]
+    assert parsed.index.tolist() == list(range(10, 10 + len(texts)))
+
+
+def test_parse_amount_series_marks_unparseable_as_nan():
+    parsed = parse_amount_series(pd.Series(["abc", "", None]))
+    assert all(math.isnan(v) for v in parsed)
+
+
+INTENTS = [
+    ("halo", "conversation"),
+    ("Terima kasih!", "conversation"),
+    ("ok", "conversation"),
+    ("berapa total pengeluaran bulan ini?", "data_query"),
+    ("tunjukkan transaksi terbesar", "data_query"),
+    ("bayar listrik 350000 bulan ini?", None),
+    ("total belanja 150000 hari ini?", None),
+    ("cek transaksi 50000 tadi", None),
+    ("berapa saldo setelah beli kopi 25rb?", None),
+    ("total pengeluaran Rp 1.200.000?", None),
+    ("beli kopi", None),
+]
+
+
+@pytest.mark.parametrize("text, expected", INTENTS)
+def test_quick_intent(text, expected):
+    assert quick_intent(text) == expected
@@ -4,6 +4,8 @@ Utility functions for the finance chatbot.
 
 import re
 import logging
+from functools import lru_cache
+from types import MappingProxyType
 from datetime import datetime, date, timedelta
 from dateutil import parser as dateparser
 from typing import Dict, Optional, List, Any, Tuple
@@ -12,6 +14,52 @@ import json
 
 logger = logging.getLogger("finance_chatbot")
 
+# Patterns used by parse_amount, compiled once at import
+_CURRENCY_RE = re.compile(r"rupiah|idr|rp\.?|\$|\s")
+_AMOUNT_CLEAN_RE = re.compile(r"[^\d,.\-]")
+# A lone dot followed by exactly three digits is an Indonesian thousands separator: 50.000
+_THOUSANDS_RE = re.compile(r"-?\d+\.\d{3}")
+# Indonesian shorthand suffixes -> multiplier
+_AMOUNT_SUFFIXES = MappingProxyType({"ribu": 1_000, "juta": 1_000_000, "rb": 1_000, "jt": 1_000_000, "k": 1_000})
+# A number and its shorthand suffix as one token, so trailing words or punctuation don't hide it:
+# "50k.", "25rb ya", "2 juta rupiah"
+_SUFFIX_AMOUNT_RE = re.compile(r"(-?\d[\d.,]*)\s*(ribu|juta|rb|jt|k)\b")
+
+# Google Sheets URL -> spreadsheet ID
+_SHEET_URL_RE = re.compile(r"/spreadsheets/d/([a-zA-Z0-9-_]+)")
+
+# Indonesian category variants -> canonical category, built once at import (read-only)
+_CATEGORY_MAP = MappingProxyType({
+    "makan": "food",
+    "makanan": "food",
+    "transport": "transport",
+    "transportasi": "transport",
+    "gaji": "income",
+    "bayar": "bills",
+    "tagihan": "bills",
+    "belanja": "shopping",
+    "hiburan": "entertainment",
+    "kesehatan": "health",
+    "pendidikan": "education",
+})
+
+# en-US -> Indonesian number separators, for format_amount
+_ID_SEPARATORS = str.maketrans({",": ".", ".": ","})
+
+# Local intent heuristics, used to skip the Gemini classification call on clear-cut messages
+# Any digit run counts, grouped or not: "15000", "50.000", "25rb"
+_AMOUNT_TOKEN_RE = re.compile(r"\d[\d.,]*\s*(?:k|rb|ribu|jt|juta)?", re.I)
+_WORD_RE = re.compile(r"[a-z]+")
+_QUERY_WORDS = frozenset({"berapa", "apa", "apakah", "tunjukkan", "tampilkan", "lihat", "cek", "mana", "bandingkan"})
+_DATA_WORDS = frozenset({
+    "pengeluaran", "pemasukan", "transaksi", "saldo", "kategori", "total", "terbesar",
+    "terkecil", "rata", "bulan", "minggu", "tahun", "ringkasan",
+})
+_SMALL_TALK = frozenset({
+    "hi", "hai", "halo", "hello", "hey", "pagi", "siang", "sore", "malam",
+    "makasih", "terima kasih", "thanks", "thank you", "thx", "ok", "oke", "sip", "mantap",
+})
+
 class ParseError(Exception):
     pass
 
@@ -36,71 +84,94 @@ def parse_credentials_string(credentials_string: str) -> Dict[str, Any]:
         logger.exception(f"An unexpected error occurred while parsing credentials: {e}")
         raise
 
+@lru_cache(maxsize=1024)
 def parse_amount(text: str) -> float:
     """
-    Parse amount like '50k', 'Rp 1.200.000', '1,200.50', '1000' -> float (IDR decimal)
+    Parse amount like '50k', '25rb', '1,5jt', 'Rp 1.200.000', '1,200.50', '1000' -> float (IDR decimal)
     """
     original = text
     try:
-        text = text.lower().strip()
-        # remove currency symbols
-        text = re.sub(r"[^\d,.\-k]", "", text)
-        # handle 'k' shorthand
-        if "k" in text:
-            num = re.sub(r"[k]", "", text)
-            num = num.replace(",", ".")
-            value = float(num) * 1000
-            logger.debug(f"parse_amount: '{original}' -> {value}")
+        text = text.lower()
+        # handle 'k' / 'rb' / 'ribu' / 'jt' / 'juta' shorthand
+        shorthand = _SUFFIX_AMOUNT_RE.search(text)
+        if shorthand:
+            num, suffix = shorthand.groups()
+            value = float(num.replace(",", ".")) * _AMOUNT_SUFFIXES[suffix]
+            logger.debug("parse_amount: '%s' -> %s", original, value)
             return value
+        # remove currency symbols, spaces and words
+        text = _AMOUNT_CLEAN_RE.sub("", _CURRENCY_RE.sub("", text))
         # replace thousands separators if dots used
-        # detect pattern like 1.200.000 or 1,200,000
-        if text.count(".") > 1 and "," not in text:
+        # detect pattern like 50.000, 1.200.000 or 1,200,000
+        if _THOUSANDS_RE.fullmatch(text) or (text.count(".") > 1 and "," not in text):
             text = text.replace(".", "")
         elif text.count(",") > 1 and "." not in text:
             text = text.replace(",", "")
+        # both present (1,200.50 or 1.200,50): the last one is the decimal separator
+        elif "," in text and "." in text:
+            thousands = "," if text.rfind(".") > text.rfind(",") else "."
+            text = text.replace(thousands, "").replace(",", ".")
         # unify comma as decimal if needed
         if "," in text and "." not in text:
             text = text.replace(",", ".")
         value = float(text)
-        logger.debug(f"parse_amount: '{original}' -> {value}")
+        logger.debug("parse_amount: '%s' -> %s", original, value)
         return value
     except Exception as e:
         logger.exception("Failed parsing amount")
         raise ParseError(f"cannot parse amount from '{original}': {e}")
 
+def parse_amount_series(values: pd.Series) -> pd.Series:
+    """
+    parse_amount for a whole column with vectorized string ops; unparseable entries become NaN.
+    """
+    lowered = values.astype(str).str.lower()
+    shorthand = lowered.str.extract(_SUFFIX_AMOUNT_RE)
+    plain = shorthand[1].isna()
+    multiplier = shorthand[1].map(_AMOUNT_SUFFIXES).fillna(1.0)
+    text = lowered.str.replace(_CURRENCY_RE, "", regex=True).str.replace(_AMOUNT_CLEAN_RE, "", regex=True)
+    text = text.mask(~plain, shorthand[0])
+    # same separator rules as parse_amount; shorthand amounts only ever use a decimal separator
+    dots, commas = text.str.count(r"\."), text.str.count(",")
+    both = (dots > 0) & (commas > 0)
+    dot_last = text.str.rfind(".") > text.str.rfind(",")
+    lone_thousands = text.str.fullmatch(_THOUSANDS_RE.pattern)
+    drop_dots = plain & (lone_thousands | ((dots > 1) & (commas == 0)) | (both & ~dot_last))
+    drop_commas = plain & (((commas > 1) & (dots == 0)) | (both & dot_last))
+    text = text.mask(drop_dots, text.str.replace(".", "", regex=False))
+    text = text.mask(drop_commas, text.str.replace(",", "", regex=False))
+    return pd.to_numeric(text.str.replace(",", ".", regex=False), errors="coerce") * multiplier
+
+@lru_cache(maxsize=1024)
 def normalize_category(cat: Optional[str]) -> str:
     if not cat:
         return "uncategorized"
     cat = cat.strip().lower()
-    mapping = {
-        "makan": "food",
-        "makanan": "food",
-        "transport": "transport",
-        "transportasi": "transport",
-        "gaji": "income",
-        "bayar": "bills",
-        "tagihan": "bills",
-        "belanja": "shopping",
-        "hiburan": "entertainment",
-        "kesehatan": "health",
-        "pendidikan": "education",
-    }
-    return mapping.get(cat, cat.replace(" ", "_"))
+    return _CATEGORY_MAP.get(cat, cat.replace(" ", "_"))
+
+@lru_cache(maxsize=1024)
+def quick_intent(text: str) -> Optional[str]:
+    """
+    Classify obvious messages locally: "data_query" for a question about the data that names no
+    amount, "conversation" for greetings and thanks. Returns None when Gemini should decide.
+    """
+    lowered = text.strip().lower()
+    if lowered.rstrip("!.? ") in _SMALL_TALK:
+        return "conversation"
+    if _AMOUNT_TOKEN_RE.search(lowered):
+        return None
+    words = set(_WORD_RE.findall(lowered))
+    if words & _DATA_WORDS and (words & _QUERY_WORDS or lowered.endswith("?")):
+        return "data_query"
+    return None
 
 def format_amount(amount: float) -> str:
     """
     Format amount to Indonesian format: 1.200.000,50 (dot as thousand separator, comma as decimal)
     """
     try:
-        # Format to 2 decimal places
-        formatted = f"{amount:,.2f}"
-        # Replace comma with dot for thousand separator
-        formatted = formatted.replace(",", "X")
-        # Replace dot with comma for decimal separator
-        formatted = formatted.replace(".", ",")
-        # Replace X with dot for thousand separator
-        formatted = formatted.replace("X", ".")
-        return formatted
+        # Format to 2 decimal places, then swap the separators in one pass
+        return f"{amount:,.2f}".translate(_ID_SEPARATORS)
     except Exception as e:
         logger.exception("Failed formatting amount")
         return str(amount)
@@ -111,14 +182,13 @@ def paginate_dataframe(df, page_size, page_num):
     end_idx = start_idx + page_size
     return df.iloc[start_idx:end_idx]
 
+@lru_cache(maxsize=1024)
 def extract_spreadsheet_id_from_url(url: str) -> Optional[str]:
     """
     Extract spreadsheet ID from Google Sheets URL.
     """
     try:
-        # Pattern for Google Sheets URL
-        pattern = r"/spreadsheets/d/([a-zA-Z0-9-_]+)"
-        match = re.search(pattern, url)
+        match = _SHEET_URL_RE.search(url)
         if match:
             return match.group(1)
         return None